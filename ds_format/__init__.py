@@ -5,45 +5,96 @@ mode = os.environ.get('DS_MODE', 'soft')
 output = 'pst'
 indent = True
 
-from .misc import \
-	escape, \
-	unescape, \
-	with_mode
-from .drivers.netcdf import from_netcdf, to_netcdf
-from .op import \
-	apply, \
-	attr, \
-	attrs, \
-	copy, \
-	dim, \
-	dims, \
-	find, \
-	findall, \
-	get_attrs, \
-	get_dims, \
-	get_meta, \
-	get_vars, \
-	group_by, \
-	merge, \
-	meta, \
-	rename, \
-	rename_attr, \
-	rename_attr_m, \
-	rename_dim, \
-	rename_dim_m, \
-	rename_m, \
-	require, \
-	rm, \
-	rm_attr, \
-	select, \
-	size, \
-	split, \
-	time, \
-	type_ as type, \
-	var, \
-	vars_ as vars, \
-	time_dt
-from .io import read, readdir, index, write
-from .validate import validate
-from . import cmd
-from . import misc
+import sys
+import types
+import importlib
+
+# Names exported by the package and the modules and names they are defined
+# as. The modules are imported on first access to the names.
+EXPORTS = {
+	'escape': ('misc', 'escape'),
+	'unescape': ('misc', 'unescape'),
+	'with_mode': ('misc', 'with_mode'),
+	'Dataset': ('dataset', 'Dataset'),
+	'from_netcdf': ('drivers.netcdf', 'from_netcdf'),
+	'to_netcdf': ('drivers.netcdf', 'to_netcdf'),
+	'apply': ('op', 'apply'),
+	'attr': ('op', 'attr'),
+	'attrs': ('op', 'attrs'),
+	'copy': ('op', 'copy'),
+	'dim': ('op', 'dim'),
+	'dims': ('op', 'dims'),
+	'find': ('op', 'find'),
+	'findall': ('op', 'findall'),
+	'get_attrs': ('op', 'get_attrs'),
+	'get_dims': ('op', 'get_dims'),
+	'get_meta': ('op', 'get_meta'),
+	'get_vars': ('op', 'get_vars'),
+	'group_by': ('op', 'group_by'),
+	'merge': ('op', 'merge'),
+	'meta': ('op', 'meta'),
+	'rename': ('op', 'rename'),
+	'rename_attr': ('op', 'rename_attr'),
+	'rename_attr_m': ('op', 'rename_attr_m'),
+	'rename_dim': ('op', 'rename_dim'),
+	'rename_dim_m': ('op', 'rename_dim_m'),
+	'rename_m': ('op', 'rename_m'),
+	'require': ('op', 'require'),
+	'rm': ('op', 'rm'),
+	'rm_attr': ('op', 'rm_attr'),
+	'select': ('op', 'select'),
+	'size': ('op', 'size'),
+	'split': ('op', 'split'),
+	'time': ('op', 'time'),
+	'type': ('op', 'type_'),
+	'var': ('op', 'var'),
+	'vars': ('op', 'vars_'),
+	'time_dt': ('op', 'time_dt'),
+	'read': ('io', 'read'),
+	'readdir': ('io', 'readdir'),
+	'iterdir': ('io', 'iterdir'),
+	'index': ('io', 'index'),
+	'write': ('io', 'write'),
+	'append': ('io', 'append'),
+	'validate': ('validate', 'validate'),
+}
+
+# Submodules available as attributes of the package.
+SUBMODULES = [
+	'catalog',
+	'cmd',
+	'dataset',
+	'drivers',
+	'help',
+	'io',
+	'lazy',
+	'misc',
+	'op',
+]
+
+def __getattr__(name):
+	if name in EXPORTS:
+		module, attr = EXPORTS[name]
+		x = getattr(importlib.import_module('.' + module, __name__), attr)
+	elif name in SUBMODULES:
+		x = importlib.import_module('.' + name, __name__)
+	else:
+		raise AttributeError('module %r has no attribute %r' % (__name__, name))
+	# Later access does not go through __getattr__.
+	globals()[name] = x
+	return x
+
+def __dir__():
+	return sorted(list(globals().keys()) + list(EXPORTS.keys()) + SUBMODULES)
+
+# Importing a submodule sets the attribute of the same name in the package to
+# the module. Names exported from a submodule of the same name (validate) are
+# set to the exported function instead.
+class Package(types.ModuleType):
+	def __setattr__(self, name, value):
+		if isinstance(value, types.ModuleType) and name in EXPORTS and \
+		   value.__name__ == __name__ + '.' + EXPORTS[name][0]:
+			value = getattr(value, EXPORTS[name][1])
+		super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = Package
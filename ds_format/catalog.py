@@ -0,0 +1,144 @@
+import os
+import copy
+import pickle
+import sqlite3
+import numpy as np
+import ds_format as ds
+
+# Default name of a catalog file in a directory.
+FILENAME = '.ds-catalog'
+
+# Catalog of file metadata stored in an SQLite database. Entries are keyed by
+# the file path relative to the catalog directory, and are valid as long as
+# the file size and modification time are unchanged. An entry is a dict with
+# the full metadata of the file (meta) and the minimum and maximum of
+# variables (ranges), which are added when a variable is used in a between
+# selector for the first time.
+class Catalog(object):
+	def __init__(self, filename):
+		self.filename = filename
+		self.dirname = os.path.dirname(os.path.abspath(filename))
+		self.con = sqlite3.connect(filename)
+		self.con.execute('''CREATE TABLE IF NOT EXISTS files (
+			path TEXT PRIMARY KEY,
+			size INTEGER,
+			mtime INTEGER,
+			entry BLOB
+		)''')
+
+	def key(self, filename):
+		return os.path.relpath(os.path.abspath(filename), self.dirname)
+
+	def get(self, filename, st):
+		row = self.con.execute(
+			'SELECT size, mtime, entry FROM files WHERE path = ?',
+			(self.key(filename),)
+		).fetchone()
+		if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+			return None
+		return pickle.loads(row[2])
+
+	def put(self, filename, st, entry):
+		self.con.execute(
+			'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+			(self.key(filename), st.st_size, st.st_mtime_ns,
+				pickle.dumps(entry))
+		)
+
+	def close(self):
+		self.con.commit()
+		self.con.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def open_(catalog, dirname):
+	# Open a catalog passed as the catalog argument of readdir or index.
+	if catalog is False or catalog is None:
+		return None
+	if catalog is True:
+		catalog = os.path.join(dirname, FILENAME)
+	return Catalog(catalog)
+
+def var_range(data):
+	x = np.ma.asarray(data)
+	if x.dtype.kind not in 'biuf':
+		return None
+	x = x.compressed() if np.ma.is_masked(x) else np.ma.getdata(x).flatten()
+	if x.dtype.kind == 'f':
+		x = x[np.isfinite(x)]
+	if len(x) == 0:
+		return None
+	return [x.min().item(), x.max().item()]
+
+def scan(filename):
+	d = ds.read(filename, [], full=True)
+	return {'meta': d['.'], 'ranges': {}}
+
+def add_ranges(filename, entry, vars_):
+	# Add ranges of variables to entry. Returns True if entry was changed.
+	vars_ = [
+		var for var in vars_
+		if var not in entry['ranges'] and ds.escape(var) in entry['meta']
+	]
+	if len(vars_) == 0:
+		return False
+	d = ds.read(filename, vars_)
+	for var in vars_:
+		entry['ranges'][var] = var_range(ds.var(d, var))
+	return True
+
+def may_match(entry, between):
+	# False if values of a between variable are all outside the range.
+	for var, b in between.items():
+		if var not in entry['ranges'] or \
+		   isinstance(b[0], str) or isinstance(b[1], str):
+			continue
+		r = entry['ranges'][var]
+		if r is None:
+			continue
+		if b[0] is not None and r[1] < b[0] or \
+		   b[1] is not None and r[0] >= b[1]:
+			return False
+	return True
+
+def is_meta_only(variables, kwargs):
+	return variables is not None and len(variables) == 0 and \
+		kwargs.get('full', False) and \
+		all([kwargs.get(k) is None for k in ('sel', 'range_', 'at', 'between')])
+
+def read(filename, variables, kwargs, entry):
+	# Read a file with the help of a catalog entry (None if the file has no
+	# valid entry). Returns the dataset (None if the file is skipped because
+	# of the between selector), the entry and True if the entry was changed.
+	changed = False
+	if entry is None:
+		entry = scan(filename)
+		changed = True
+	between = kwargs.get('between') or {}
+	if add_ranges(filename, entry, list(between.keys())):
+		changed = True
+	if not may_match(entry, between):
+		return None, entry, changed
+	if is_meta_only(variables, kwargs):
+		d = {'.': copy.deepcopy(entry['meta'])}
+	else:
+		d = ds.read(filename, variables, **kwargs)
+	return d, entry, changed
+
+def read_meta(filename):
+	# Read metadata of a file from the catalog in its directory. Returns None
+	# if the directory has no catalog.
+	catalog = os.path.join(os.path.dirname(filename), FILENAME)
+	if not os.path.isfile(catalog) or not os.path.isfile(filename):
+		return None
+	st = os.stat(filename)
+	with Catalog(catalog) as c:
+		entry = c.get(filename, st)
+		d, entry, changed = read(filename, [], {'full': True}, entry)
+		if changed:
+			c.put(filename, st, entry)
+	return d
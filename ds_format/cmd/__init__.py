@@ -1,49 +1,91 @@
-from .attrs import attrs
-from .cat import cat
-from .dim import dim
-from .dims import dims
-from .ls import ls
-from .merge import merge
-from .meta import meta
-from .rename import rename
-from .rename_dim import rename_dim
-from .rm import rm
-from .select import select
-from .stats import stats
-from .set_ import set_
-from .size import size
-from .type_ import type_
-
-CMDS = {
-	'attrs': attrs,
-	'cat': cat,
-	'dim': dim,
-	'dims': dims,
-	'ls': ls,
-	'merge': merge,
-	'meta': meta,
-	'rename': rename,
-	'rename_dim': rename_dim,
-	'rm': rm,
-	'select': select,
-	'stats': stats,
-	'set': set_,
-	'size': size,
-	'type': type_,
+import sys
+import types
+import importlib
+from collections.abc import Mapping
+
+# Command names and the modules and functions implementing them.
+COMMANDS = {
+	'append': ('append', 'append'),
+	'attrs': ('attrs', 'attrs'),
+	'batch': ('batch', 'batch'),
+	'cat': ('cat', 'cat'),
+	'dim': ('dim', 'dim'),
+	'dims': ('dims', 'dims'),
+	'ls': ('ls', 'ls'),
+	'merge': ('merge', 'merge'),
+	'meta': ('meta', 'meta'),
+	'rename': ('rename', 'rename'),
+	'rename_dim': ('rename_dim', 'rename_dim'),
+	'rm': ('rm', 'rm'),
+	'select': ('select', 'select'),
+	'serve': ('serve', 'serve'),
+	'stats': ('stats', 'stats'),
+	'set': ('set_', 'set_'),
+	'size': ('size', 'size'),
+	'type': ('type_', 'type_'),
 }
 
+def load(name):
+	module, func = COMMANDS[name]
+	return getattr(importlib.import_module('.' + module, __name__), func)
+
+# Mapping of command names to functions. The module of a command is imported
+# when the command is first looked up.
+class Commands(Mapping):
+	def __init__(self):
+		self.funcs = {}
+
+	def __getitem__(self, name):
+		if name not in self.funcs:
+			self.funcs[name] = load(name)
+		return self.funcs[name]
+
+	def __contains__(self, name):
+		return name in COMMANDS
+
+	def __iter__(self):
+		return iter(COMMANDS)
+
+	def __len__(self):
+		return len(COMMANDS)
+
+CMDS = Commands()
+
 READ_OPTS = [
 	'at',
 	'between',
+	'mmap',
 	'range',
 	'sel',
+	'threads',
 ]
 
 WRITE_OPTS = [
 	'calendar',
+	'chunks',
+	'compression',
+	'threads',
 	'time_units',
 ]
 
 GLOBAL_OPTS = [
 	'F',
 ]
+
+def __getattr__(name):
+	for k, (module, func) in COMMANDS.items():
+		if func == name:
+			return CMDS[k]
+	raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+# Importing the module of a command sets the attribute of the same name in the
+# package to the module, which is replaced with the function of the command.
+class Package(types.ModuleType):
+	def __setattr__(self, name, value):
+		if isinstance(value, types.ModuleType):
+			for module, func in COMMANDS.values():
+				if func == name and value.__name__ == __name__ + '.' + module:
+					value = getattr(value, func)
+		super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = Package
@@ -0,0 +1,55 @@
+import os
+import ds_format as ds
+from ds_format.misc import cmd, UsageError, check
+
+@cmd()
+def append(dim, *args, F=False, r={}, w={}):
+	r'''
+	title: append
+	caption: "Append datasets to a file along a dimension."
+	usage: "`ds append` [*options*] *dim* [\\--] *input*... *output*"
+	desc: "Append datasets *input* to a DS file *output* along a dimension *dim*. Only the appended data are written to *output*, instead of rewriting the whole file. If *output* does not exist, it is created from the first input. Variables in *output* without the dimension *dim* are left unchanged. Variables with the dimension *dim* missing in an input are extended with missing values."
+	arguments: {{
+		*dim*: "Name of a dimension to append along."
+		*input*: "Input file."
+		*output*: "Output file. Only DS files are supported."
+		*options*: "See help for ds for global options. Write options are only applied when *output* is created."
+	}}
+	examples: {{
+"Write example data to dataset1.nc.":
+"$ ds set { time none time { 1 2 3 } long_name: time units: s } { temperature none time { 16. 18. 21. } long_name: temperature units: celsius } title: \"Temperature data\" none dataset1.nc"
+
+"Write example data to dataset2.nc.":
+"$ ds set { time none time { 4 5 6 } long_name: time units: s } { temperature none time { 23. 25. 28. } long_name: temperature units: celsius } title: \"Temperature data\" none dataset2.nc"
+
+"Append dataset1.nc and dataset2.nc to dataset.ds.":
+"$ ds append time dataset1.nc dataset2.nc dataset.ds"
+
+"Print time and temperature variables in dataset.ds.":
+"$ ds cat time temperature dataset.ds
+time temperature
+1 16.000000
+2 18.000000
+3 21.000000
+4 23.000000
+5 25.000000
+6 28.000000"
+	}}
+	'''
+	if len(args) < 1:
+		raise UsageError('invalid number of arguments')
+	input_ = args[:-1]
+	output = args[-1]
+
+	check(dim, 'dim', str)
+	check(input_, 'input', list, str)
+	check(output, 'output', str)
+
+	for filename in input_:
+		d = ds.read(filename, **r)
+		if not F:
+			dim = ds.find(d, 'dim', dim)
+		if os.path.exists(output):
+			ds.append(output, d, dim)
+		else:
+			ds.write(output, d, **w)
@@ -0,0 +1,48 @@
+import sys
+import shlex
+import traceback
+from ds_format.misc import cmd
+import ds_format as ds
+
+@cmd()
+def batch(*, r={}, w={}):
+	r'''
+	title: batch
+	caption: "Execute commands read from standard input."
+	usage: "`ds batch` [*options*]"
+	arguments: {{
+		*options*: "See help for ds for global options."
+	}}
+	desc: "Read commands from the standard input, one per line, and execute them in a single process. Each line contains the arguments of `ds` (without `ds`) quoted as in a POSIX shell. Empty lines and lines starting with `#` are ignored. Global options passed to `ds batch` (such as `-j`) apply to all commands. The exit status is 1 if any command failed, and 0 otherwise."
+	examples: {{
+"Print dimensions of dataset1.nc and the size of the dimension time in dataset2.nc.":
+"$ printf '%s\\n' 'dims dataset1.nc' 'dim time dataset2.nc' | ds batch
+time: 3
+3"
+	}}
+	'''
+	from ds_format.cmd.main import parse_args, main2
+	state = (ds.mode, ds.output, ds.indent)
+	status = 0
+	for line in sys.stdin:
+		line = line.strip()
+		if line == '' or line.startswith('#'):
+			continue
+		try:
+			argv = shlex.split(line)
+		except ValueError as e:
+			print(f'ds batch: {e}: {line}', file=sys.stderr)
+			status = 1
+			continue
+		ds.mode, ds.output, ds.indent = state
+		cmd, cmd_args, opts = parse_args(argv)
+		try:
+			if main2(cmd, *cmd_args, **opts) != 0:
+				status = 1
+		except Exception:
+			# Unexpected errors are reported without stopping the batch.
+			traceback.print_exc()
+			status = 1
+		sys.stdout.flush()
+	ds.mode, ds.output, ds.indent = state
+	return status
@@ -5,8 +5,95 @@ import ds_format as ds
 from ds_format import misc
 import aquarius_time as aq
 
+# Number of rows formatted at a time.
+BLOCK_SIZE = 65536
+
+def encode_float_json(x):
+	if x != x: return b'NaN'
+	if x == np.inf: return b'Infinity'
+	if x == -np.inf: return b'-Infinity'
+	return float.__repr__(x).encode('utf-8')
+
+def format_column(x, none):
+	# Format a part of a 1-D variable as a list of encoded values, with
+	# missing values encoded as none.
+	if isinstance(x, np.ndarray):
+		mask = np.ma.getmaskarray(x) if np.ma.isMaskedArray(x) else None
+		data = np.ma.getdata(x)
+		kind = data.dtype.kind
+	else:
+		kind = None
+	if kind in ('i', 'u'):
+		words = data.astype(bytes).tolist()
+	elif kind == 'b':
+		words = np.where(data, b'true', b'false').tolist()
+	elif kind == 'f':
+		encode = encode_float_json if ds.output == 'json' else b'%f'.__mod__
+		words = list(map(encode, data.tolist()))
+	else:
+		return [
+			none if y is None or y is np.ma.masked else misc.encode(y)
+			for y in x
+		]
+	if mask is not None:
+		for i in np.flatnonzero(mask):
+			words[i] = none
+	return words
+
+def format_block(xx, i, j):
+	# Format rows i to j as bytes.
+	n = j - i
+	if any([isinstance(x, np.ndarray) and x.ndim > 1 for x in xx]):
+		lines = []
+		for k in range(i, j):
+			y = [x[k] if len(x) > k else None for x in xx]
+			if len(y) == 1: y = y[0]
+			lines += [misc.encode(y)]
+		return b'\n'.join(lines) + b'\n'
+	none = b'null' if ds.output == 'json' else b'none'
+	cols = []
+	for x in xx:
+		words = format_column(x[i:j], none)
+		cols += [words + [none]*(n - len(words))]
+	if len(cols) == 1:
+		lines = cols[0]
+		if ds.output != 'json':
+			# Missing values are printed as empty lines.
+			lines = [b'' if y == none else y for y in lines]
+	elif ds.output == 'json' and ds.indent:
+		lines = [
+			b'[\n    ' + b',\n    '.join(y) + b'\n]'
+			for y in zip(*cols)
+		]
+	elif ds.output == 'json':
+		lines = [b'[' + b', '.join(y) + b']' for y in zip(*cols)]
+	else:
+		lines = list(map(b' '.join, zip(*cols)))
+	return b'\n'.join(lines) + b'\n'
+
+def write_raw(x, format_):
+	x = np.ma.asarray(x if x is not None else [])
+	if x.dtype.kind == 'O':
+		raise ValueError('raw output of string variables is not supported')
+	if np.ma.is_masked(x):
+		x = x.filled(np.nan if x.dtype.kind == 'f' else None)
+	x = np.ascontiguousarray(np.ma.getdata(x))
+	if format_ == 'npy':
+		np.lib.format.write_array(sys.stdout.buffer, x, allow_pickle=False)
+	else:
+		sys.stdout.buffer.write(memoryview(x).cast('B'))
+
+def window_slice(n, offset, limit, tail):
+	# Slice of a dimension of size n selected by offset, limit and tail.
+	start = 0 if offset is None else min(offset, n)
+	end = n if limit is None else min(start + limit, n)
+	if tail is not None:
+		start = max(start, end - tail)
+	return slice(start, end)
+
 @cmd()
-def cat(*args, n=False, F=False, jd=False, h=False, r={}, w={}):
+def cat(*args, n=False, F=False, jd=False, h=False, b=False, raw=False,
+	offset=None, limit=None, tail=None, r={}, w={}):
 	r'''
 	title: cat
 	caption: "Print variable data."
@@ -20,8 +107,13 @@ def cat(*args, n=False, F=False, jd=False, h=False, r={}, w={}):
 		`-h`: "Print human-readable values (time as ISO 8601)."
 		`--jd`: "Convert time variables to Julian date (see [Aquarius Time](https://github.com/peterkuma/aquarius-time))."
 		`-n`:  "Do not print header."
+		"`-b`, `--raw`": "Write the variable data in the native binary format (C order) instead of text, without a header. Variables are written one after another. Missing values are written as NaN in floating-point variables and as the NumPy default fill value in other variables. String variables are not supported."
+		"`raw:` *format*": "Write the variable data in a binary format: `bin` (the same as `--raw`) or `npy` (NumPy array format, one array per variable)."
+		"`offset:` *n*": "Skip the first *n* items."
+		"`limit:` *n*": "Print at most *n* items."
+		"`tail:` *n*": "Print the last *n* items (of the items selected by `offset` and `limit`, if any)."
 	}}
-	desc: "Data are printed by the first index, one item per line, formatted as [PST](https://github.com/peterkuma/pst)-formatted. If multiple variables are selected, items at a given index from all variables are printed on the same line as an array. The first line is a header containing a list of variables. Missing values are printed as empty rows (if printing one single dimensional variable) or as `none`."
+	desc: "Data are printed by the first index, one item per line, formatted as [PST](https://github.com/peterkuma/pst)-formatted. If multiple variables are selected, items at a given index from all variables are printed on the same line as an array. The first line is a header containing a list of variables. Missing values are printed as empty rows (if printing one single dimensional variable) or as `none`. The `offset`, `limit` and `tail` options select items along the first dimension of the variables. Unless other selectors are used, only the selected items are read from the input file."
 	examples: {{
 "Print temperature values in dataset.nc.":
 "$ ds cat temperature dataset.nc
@@ -36,6 +128,12 @@ time temperature
 1 16.000000
 2 18.000000
 3 21.000000"
+
+"Print the last two temperature values in dataset.nc.":
+"$ ds cat temperature dataset.nc tail: 2
+temperature
+18.000000
+21.000000"
 	}}
 	'''
 	if len(args) < 1:
@@ -46,11 +144,41 @@ time temperature
 	check(vars_, 'var', list, str, elemental=True)
 	check(input_, 'input', str)
 	check(n, 'n', bool)
+	check(b, 'b', bool)
+	check(raw, 'raw', [bool, str])
+	if raw not in (True, False, 'bin', 'npy'):
+		raise ValueError('invalid raw format "%s"' % raw)
+	if b and raw is False:
+		raw = 'bin'
+	elif raw is True:
+		raw = 'bin'
+	for k, v in [('offset', offset), ('limit', limit), ('tail', tail)]:
+		check(v, k, [int, None])
+		if v is not None and v < 0:
+			raise ValueError('%s must be non-negative' % k)
+	window = offset is not None or limit is not None or tail is not None
 
+	d = None
 	if not F:
 		d = ds.read(input_, [], full=True, **r)
 		vars_ = [x for var in vars_ for x in ds.findall(d, 'var', var)]
 
+	# Without other selectors, the window is read from the file as a
+	# selector on the first dimension. Otherwise, it is applied after reading.
+	pushdown = window and \
+		all([r.get(k) is None for k in ('sel', 'range_', 'at', 'between')])
+	if pushdown:
+		if d is None:
+			d = ds.read(input_, [], full=True, **r)
+		available_vars = ds.vars(d, full=True)
+		vars1 = [var for var in vars_ if var in available_vars]
+		dims1 = ds.dims(d, vars1[0]) if len(vars1) > 0 else []
+		if len(dims1) > 0:
+			s = window_slice(ds.dim(d, dims1[0], full=True), offset, limit,
+				tail)
+			r = dict(r, sel={dims1[0]: s})
+			window = False
+
 	d = ds.read(input_, vars_, full=False, jd=(jd or h), **r)
 	if len(vars_) == 0:
 		return
@@ -58,6 +186,18 @@ time temperature
 	if not all([dim == dims[0] for dim in dims]):
 		raise ValueError('incompatible dimensions')
 
+	if window:
+		for var in vars_:
+			x = ds.var(d, var)
+			if isinstance(x, np.ndarray) and x.ndim > 0:
+				s = window_slice(len(x), offset, limit, tail)
+				ds.var(d, var, x[s])
+
+	if raw:
+		for var in vars_:
+			write_raw(ds.var(d, var), raw)
+		return
+
 	if not n:
 		vars1 = vars_[0] if len(vars_) == 1 else vars_
 		sys.stdout.buffer.write(misc.encode(vars1) + b'\n')
@@ -75,7 +215,6 @@ time temperature
 		if not isinstance(x, np.ndarray) or x.ndim == 0:
 			x = [x]
 		xx += [x]
-	for i in range(len(xx[0])):
-		y = [x[i] if len(x) > i else None for x in xx]
-		if len(y) == 1: y = y[0]
-		sys.stdout.buffer.write(misc.encode(y) + b'\n')
+	for i in range(0, len(xx[0]), BLOCK_SIZE):
+		j = min(i + BLOCK_SIZE, len(xx[0]))
+		sys.stdout.buffer.write(format_block(xx, i, j))
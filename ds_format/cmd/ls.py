@@ -18,7 +18,7 @@ def ls(*args, a=None, F=False, l=False, r={}, w={}):
 		`-l`: "Print a detailed list of variables (name, type and an array of dimensions), preceded with a line with dataset dimensions."
 		"`a:` *attrs*": "Print variable attributes after the variable name and dimensions. *attrs* can be a string or an array."
 	}}
-	desc: "Lines in the output are formatted as [PST](https://github.com/peterkuma/pst)."
+	desc: "Lines in the output are formatted as [PST](https://github.com/peterkuma/pst). If the directory of *input* contains a catalog `.ds-catalog` (see **[readdir](#readdir)**), the metadata are read from the catalog, and the catalog is updated if the file is new or modified."
 	examples: {{
 "Print a list of variables in `dataset.nc`.":
 "$ ds ls dataset.nc
@@ -55,7 +55,9 @@ temperature"
 	check(input_, 'input', str)
 	check(a, 'a', [None, str, [list, str]])
 
-	d = ds.read(input_, [], full=True, **r)
+	d = ds.catalog.read_meta(input_) if len(r) == 0 else None
+	if d is None:
+		d = ds.read(input_, [], full=True, **r)
 	available_vars = ds.vars(d, full=True)
 
 	if len(vars_) == 0:
@@ -4,8 +4,6 @@ import sys
 import traceback
 import pst
 import ds_format as ds
-from ds_format.help import help_to_text, help_to_usage
-from ds_format.misc import UsageError
 from ds_format.cmd import GLOBAL_OPTS, READ_OPTS, WRITE_OPTS
 
 USAGE = '''Usage: ds [CMD] [OPTIONS]
@@ -13,7 +11,7 @@ USAGE = '''Usage: ds [CMD] [OPTIONS]
 	   ds --version
 Use `ds --help` for help.'''
 
-def parse_args(argv):
+def decode_args(argv):
 	try:
 		delim = argv.index('--')
 	except ValueError:
@@ -25,17 +23,21 @@ def parse_args(argv):
 	elif type(args) is not list:
 		args = [args]
 	args += argv[(delim+1):]
+	return args
 
-	cmd = None
-	icmd = -1
-	with_cmd_opts = True
+def find_cmd(args):
+	# Index of the command in decoded arguments args or -1. The command is
+	# not imported.
 	for i, arg in enumerate(args):
-		func = ds.cmd.CMDS.get(arg) if type(arg) is str else None
-		if func is not None:
-			cmd = arg
-			icmd = i
-			with_cmd_opts = func.cmd_opts
-			break
+		if type(arg) is str and arg in ds.cmd.CMDS:
+			return i
+	return -1
+
+def parse_args(argv):
+	args = decode_args(argv)
+	icmd = find_cmd(args)
+	cmd = args[icmd] if icmd >= 0 else None
+	with_cmd_opts = ds.cmd.CMDS[cmd].cmd_opts if cmd is not None else True
 
 	cmd_args = []
 	opts = {}
@@ -48,6 +50,50 @@ def parse_args(argv):
 
 	return cmd, cmd_args, opts
 
+# Standard input, output and error file descriptors passed to the server.
+FDS = [0, 1, 2]
+
+def send_request(sock, req):
+	# Send a request with the standard file descriptors of the process.
+	import array
+	import socket
+	import struct
+	import pickle
+	data = pickle.dumps(req)
+	fds = array.array('i', FDS)
+	sock.sendmsg([struct.pack('!I', len(data))],
+		[(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+	sock.sendall(data)
+
+def request(server, argv):
+	# Run a command with arguments argv in the server listening on the socket
+	# server (see serve). Returns the exit status, or None if the server is
+	# not running.
+	import socket
+	import struct
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		try:
+			sock.connect(server)
+		except OSError:
+			return None
+		send_request(sock, {
+			'argv': argv,
+			'cwd': os.getcwd(),
+			'env': dict(os.environ),
+		})
+		sys.stdout.flush()
+		sys.stderr.flush()
+		status = b''
+		while len(status) < 4:
+			x = sock.recv(4 - len(status))
+			if len(x) == 0:
+				return 1
+			status += x
+		return struct.unpack('!i', status)[0]
+	finally:
+		sock.close()
+
 def fix_rw_opts(opts):
 	def fix_k(k):
 		if k == 'range':
@@ -87,7 +133,9 @@ def main():
 	}}
 	desc: "The command line interface is based on the [PST format](https://github.com/peterkuma/pst). In all commands, variable, dimension and attribute names are interpreted as [glob patterns](https://docs.python.org/3/library/fnmatch.html), unless the `-F` option is enabled. Note that the pattern has to be enclosed in quotes in order to prevent the shell from interpreting the glob."
 	"Available commands": {{
+		`append`: "Append files along a dimension."
 		`attrs`: "Print attributes in a dataset."
+		`batch`: "Execute commands read from standard input."
 		`cat`: "Print variable data."
 		`dim`: "Print dimension size."
 		`dims`: "Print dimensions of a dataset or a variable."
@@ -98,6 +146,7 @@ def main():
 		`rename_dim`: "Rename a dimension."
 		`rm`: "Remove variables or attributes."
 		`select`: "Select and subset variables."
+		`serve`: "Run a server executing commands."
 		`set`: "Set variable data, dimensions and attributes in an existing or new dataset."
 		`size`: "Print variable size."
 		`stats`: "Print variable statistics."
@@ -120,20 +169,35 @@ def main():
 	"Read options": {{
 		"`at:` *selector*": "At selector as `{` *var*`:` *value* ... `}` or `{` *var*`:` `{` *value*... `}` ... `}`, where *value* is the value of the variable *var* to select. The dimension indexes corresponding the variable are constrained so that a variable value closest to the value is selected."
 		"`between:` *selector*": "Between selector as `{` *var*`: {` *start* *end* `}` ... `}`, where *start* is the start value of the variable *var*, and *end* is the end value. The dimension indexes corresponding to the variable are constrained so that variable values in the range are selected. If the value is `none`, the range start or end is unlimited. The range start is inclusive (closed), and the end is exclusive (open)."
+		"`mmap:` *value*": "If `true`, memory-map input DS files instead of reading them into memory. Only the parts of the file which are accessed are read from the disk."
 		"`range:` *selector*": "Range selector as `{` *dim*`: {` *start* *end* `}` ... `}`, where *start* is the start index of the dimension *dim*, and *end* is the end index. If the index is `none`, the range is from the start or to the end of the dimension, respectively. Negative index values are counted from the end of the dimension. The range start is inclusive (closed), and the end is exclusive (open)."
 		"`sel:` *selector*": "Selector as *dim*`:` *idx* pairs, where *dim* is a dimension name and *idx* is an index or a list of indexes as `{` *i*... `}`."
+		"`threads:` *value*": "Number of threads to read variables of input DS files with in parallel."
 	}}
 	"Write options": {{
 		"`calendar:` *value*": "CF-Conventions calendar to use for time variables when writing NetCDF4 and HDF5 files."
+		"`chunks:` `{` *dim*`:` *size* ... `}`": "Chunk size of variables along dimensions when writing DS files. Dimensions which are not listed are not split into chunks. If not supplied, the chunk size is chosen automatically. Selective reading of chunked variables only reads the chunks needed."
+		"`compression:` *value* \\| `{` *value*... `}`": "Compression of variable data when writing DS files. One of the compression codecs `zlib`, `lzma`, `bz2` or `none`, or an array of a codec and filters applied before compression: `shuffle` (store bytes of the same significance together) and `delta` (store differences between subsequent values)."
+		"`threads:` *value*": "Number of threads to encode, compress and write variables of DS files with in parallel."
 		"`time_units:` *value*": "CF-Conventions units to use for time variables when writing NetCDF4 and HDF5 files."
 	}}
 	environment: {{
 		DS_MODE: "Error handling mode. If \"strict\", handle missing variables, dimensions and attributes as errors. If \"moderate\", report a warning. If \"soft\", ignore missing items."
+		DS_SERVER: "Path of a Unix socket of a server started with **[serve](#serve)**. If set, commands are executed by the server instead of the `ds` process. If the server is not running, commands are executed by the `ds` process."
 	}}
 	author: "Written by Peter Kuma."
 	copyright: "Copyright (c) 2019-2026 Peter Kuma. This software is distributed under an MIT license."
 	'''
-	cmd, cmd_args, opts = parse_args(sys.argv[1:])
+	argv = sys.argv[1:]
+	server = os.environ.get('DS_SERVER')
+	if server:
+		args = decode_args(argv)
+		icmd = find_cmd(args)
+		if icmd < 0 or args[icmd] != 'serve':
+			status = request(server, argv)
+			if status is not None:
+				sys.exit(status)
+	cmd, cmd_args, opts = parse_args(argv)
 	sys.exit(main2(cmd, *cmd_args, **opts))
 
 def main2(cmd, *cmd_args,
@@ -148,6 +212,7 @@ def main2(cmd, *cmd_args,
 	**opts,
 ):
 	if help:
+		from ds_format.help import help_to_text
 		if cmd is None:
 			print(help_to_text(sys.modules[__name__].main.__doc__), end='')
 		else:
@@ -159,6 +224,8 @@ def main2(cmd, *cmd_args,
 		print(ds.__version__)
 		return 0
 
+	from ds_format.misc import UsageError
+
 	if t: ds.mode = 'soft'
 	if m: ds.mode = 'moderate'
 	if s: ds.mode = 'strict'
@@ -180,8 +247,9 @@ def main2(cmd, *cmd_args,
 
 	func = ds.cmd.CMDS[cmd]
 	try:
-		func(*cmd_args, **global_opts, r=r, w=w)
+		status = func(*cmd_args, **global_opts, r=r, w=w)
 	except UsageError as e:
+		from ds_format.help import help_to_usage
 		print(f'ds {cmd}: {e}', file=sys.stderr)
 		print(help_to_usage(func.__doc__), end='', file=sys.stderr)
 		print(f'Use `ds {cmd} --help` for command help.', file=sys.stderr)
@@ -190,4 +258,4 @@ def main2(cmd, *cmd_args,
 		if v: traceback.print_exc()
 		else: print(f'ds {cmd}: {e}', file=sys.stderr)
 		return 1
-	return 0
+	return 0 if status is None else status
@@ -8,7 +8,7 @@ def merge(dim, *args, new=None, variables=None, jd=True, F=False, r={}, w={}):
 	title: merge
 	caption: "Merge datasets along a dimension."
 	usage: "`ds merge` [*options*] *dim* [\\--] *input*... *output*"
-	desc: "Merge datasets along a dimension *dim*. If the dimension is not defined in the dataset, merge along a new dimension *dim*. If *new* is `none` and *dim* is not new, variables without the dimension *dim* are set with the first occurrence of the variable. If *new* is not `none` and *dim* is not new, variables without the dimension *dim* are merged along a new dimension *new*. If *variables* is not `none`, only those variables are merged along a new dimension, and other variables are set to the first occurrence of the variable. Variables which are merged along a new dimension and are not present in all datasets have their subsets corresponding to the datasets where they are missing filled with missing values. Dataset and variable metadata are merged sequentially from all datasets, with metadata from later datasets overriding metadata from the former ones."
+	desc: "Merge datasets along a dimension *dim*. If the dimension is not defined in the dataset, merge along a new dimension *dim*. If *new* is `none` and *dim* is not new, variables without the dimension *dim* are set with the first occurrence of the variable. If *new* is not `none` and *dim* is not new, variables without the dimension *dim* are merged along a new dimension *new*. If *variables* is not `none`, only those variables are merged along a new dimension, and other variables are set to the first occurrence of the variable. Variables which are merged along a new dimension and are not present in all datasets have their subsets corresponding to the datasets where they are missing filled with missing values. Dataset and variable metadata are merged sequentially from all datasets, with metadata from later datasets overriding metadata from the former ones. The input files are read one at a time and written to the output file by parts, unless selection options or time conversion options are used or the output format is JSON or CSV."
 	arguments: {{
 		*dim*: "Name of a dimension to merge along."
 		*input*: "Input file."
@@ -53,12 +53,5 @@ time temperature
 	check(variables, 'variabes', [[list, str], None])
 	check(jd, 'jd', bool)
 
-	dd = []
-	for filename in input_:
-		d = ds.read(filename, **r)
-		dd.append(d)
-	if not F:
-		if len(dd) > 0:
-			dim = ds.find(dd[0], 'dim', dim)
-	d = ds.op.merge(dd, dim, new=new, variables=variables, jd=jd)
-	ds.write(output, d, **w)
+	ds.io.merge_files(input_, output, dim, new=new, variables=variables,
+		jd=jd, F=F, r=r, w=w)
@@ -0,0 +1,156 @@
+import os
+import sys
+import struct
+import pickle
+import signal
+import socket
+import array
+import importlib
+import traceback
+from ds_format.misc import cmd, check
+import ds_format as ds
+
+# Modules imported by the server before accepting connections.
+PRELOAD = ['numpy', 'cftime', 'aquarius_time', 'pst', 'netCDF4', 'h5py',
+	'ds_format.help']
+
+def recv_exact(sock, n):
+	buf = b''
+	while len(buf) < n:
+		x = sock.recv(n - len(buf))
+		if len(x) == 0:
+			raise IOError('connection closed')
+		buf += x
+	return buf
+
+def recv_request(sock):
+	# Receive a request and the file descriptors sent with it. Returns None if
+	# the connection is closed without a request, such as when probed by
+	# listen.
+	from ds_format.cmd.main import FDS
+	fds = array.array('i')
+	msg, ancdata, flags, addr = sock.recvmsg(4,
+		socket.CMSG_SPACE(len(FDS)*fds.itemsize))
+	for level, type_, data in ancdata:
+		if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+			fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+	if len(msg) == 0:
+		return None, list(fds)
+	if len(msg) < 4:
+		msg += recv_exact(sock, 4 - len(msg))
+	n = struct.unpack('!I', msg)[0]
+	return pickle.loads(recv_exact(sock, n)), list(fds)
+
+def handle(conn):
+	# Run a request received on the connection conn in a forked process.
+	from ds_format.cmd.main import FDS, parse_args, main2
+	status = 1
+	try:
+		req, fds = recv_request(conn)
+		if req is None:
+			os._exit(0)
+		if len(fds) != len(FDS):
+			raise IOError('invalid request')
+		for fd, fd0 in zip(fds, FDS):
+			os.dup2(fd, fd0)
+			os.close(fd)
+		os.chdir(req['cwd'])
+		os.environ.clear()
+		os.environ.update(req['env'])
+		ds.mode = os.environ.get('DS_MODE', 'soft')
+		ds.output = 'pst'
+		ds.indent = True
+		cmd, cmd_args, opts = parse_args(req['argv'])
+		status = main2(cmd, *cmd_args, **opts)
+	except SystemExit as e:
+		status = e.code if type(e.code) is int else 1
+	except BaseException:
+		traceback.print_exc()
+	try:
+		sys.stdout.flush()
+		sys.stderr.flush()
+		conn.sendall(struct.pack('!i', status))
+	except Exception:
+		pass
+	os._exit(0)
+
+def preload():
+	for name in PRELOAD:
+		try: importlib.import_module(name)
+		except ImportError: pass
+	# Functions and commands of ds_format are otherwise imported on first use.
+	for name in ds.EXPORTS:
+		getattr(ds, name)
+	for name in ds.cmd.CMDS:
+		ds.cmd.CMDS[name]
+
+def listen(server):
+	# Create a socket listening at the path server. A stale socket file left
+	# by a server which is no longer running is replaced.
+	if os.path.exists(server):
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			sock.connect(server)
+		except (ConnectionRefusedError, FileNotFoundError):
+			os.remove(server)
+		else:
+			raise IOError('%s: server is already running' % server)
+		finally:
+			sock.close()
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	umask = os.umask(0o177)
+	try:
+		sock.bind(server)
+	finally:
+		os.umask(umask)
+	sock.listen(128)
+	return sock
+
+@cmd()
+def serve(server, *, r={}, w={}):
+	r'''
+	title: serve
+	caption: "Run a server executing commands."
+	usage: "`ds serve` *socket*"
+	arguments: {{
+		*socket*: "Path of a Unix socket to listen on."
+	}}
+	desc: "Start a server which listens on the Unix socket *socket* and executes commands sent by `ds` when the environment variable DS_SERVER is set to *socket*. Commands are executed in processes forked from the server with the Python modules used by ds already imported, which eliminates the start-up time of `ds`. The commands are executed with the working directory, environment variables, standard input, output and error of the client. The socket is only accessible by the user who started the server. The server runs until it is interrupted or terminated. Only available on systems with Unix sockets and `fork`."
+	examples: {{
+"Start a server in the background and print variables in dataset.nc through the server.":
+"$ ds serve /tmp/ds.sock &
+$ export DS_SERVER=/tmp/ds.sock
+$ ds ls dataset.nc
+temperature
+time"
+	}}
+	'''
+	check(server, 'socket', str)
+	if not hasattr(socket, 'AF_UNIX') or not hasattr(os, 'fork'):
+		raise IOError('server is not supported on this system')
+	preload()
+	sock = listen(server)
+	def stop(*args):
+		sys.exit(0)
+	signals = [signal.SIGINT, signal.SIGTERM]
+	for s in signals:
+		signal.signal(s, stop)
+	# Forked processes are reaped automatically.
+	signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+	try:
+		while True:
+			try:
+				conn, addr = sock.accept()
+			except InterruptedError:
+				continue
+			pid = os.fork()
+			if pid == 0:
+				sock.close()
+				for s in signals + [signal.SIGCHLD]:
+					signal.signal(s, signal.SIG_DFL)
+				handle(conn)
+			conn.close()
+	finally:
+		sock.close()
+		try: os.remove(server)
+		except OSError: pass
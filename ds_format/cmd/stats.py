@@ -3,9 +3,182 @@ import numpy as np
 import ds_format as ds
 from ds_format import misc
 from ds_format.misc import cmd, check
+from ds_format.lazy import LazyArray
+
+# Size in bytes of parts of a variable read at a time.
+CHUNK_SIZE = 1 << 24
+
+# Default maximum size in bytes of values held in memory for calculating
+# exact percentiles.
+MEMORY = 1 << 30
+
+# Number of values in the top level of a sketch.
+SKETCH_K = 1 << 14
+
+# Percentiles of median, p68, p95 and p99.
+PERCENTILES = [50, 16, 84, 2.5, 97.5, 0.5, 99.5]
+
+# Sketch of a distribution of values for calculating approximate percentiles
+# in limited memory (KLL). Values at level h stand for 2**h values. When a
+# level exceeds its capacity, it is sorted and every other value is moved to
+# the next level, starting from a random offset.
+class Sketch(object):
+	def __init__(self, k=SKETCH_K):
+		self.k = k
+		self.levels = [np.array([])]
+		self.rng = np.random.default_rng(0)
+
+	def capacity(self, h):
+		return max(2, int(np.ceil(self.k*(2/3)**(len(self.levels) - h - 1))))
+
+	def update(self, x):
+		self.levels[0] = np.concatenate([self.levels[0], x])
+		h = 0
+		while h < len(self.levels):
+			x = self.levels[h]
+			if len(x) > self.capacity(h):
+				if h + 1 == len(self.levels):
+					self.levels += [np.array([])]
+				x = np.sort(x)
+				m = len(x) % 2
+				i = self.rng.integers(2)
+				self.levels[h] = x[:m]
+				self.levels[h + 1] = np.concatenate([
+					self.levels[h + 1],
+					x[(m + i)::2]
+				])
+			h += 1
+
+	def percentile(self, q):
+		# Percentiles interpolated linearly between ranks as in
+		# np.percentile.
+		x = np.concatenate(self.levels)
+		w = np.concatenate([
+			np.full(len(y), 2.**h) for h, y in enumerate(self.levels)
+		])
+		ii = np.argsort(x, kind='stable')
+		x = x[ii]
+		w = w[ii]
+		rank = np.cumsum(w) - 0.5*(w + 1)
+		return np.interp(np.array(q)/100*(w.sum() - 1), rank, x)
+
+# Statistics calculated from parts of a variable in one pass. The mean and
+# variance of the parts are combined as in the parallel form of the Welford
+# algorithm. Values are kept for calculating exact percentiles, unless they
+# exceed memory bytes, in which case they are passed to a sketch.
+class Stats(object):
+	def __init__(self, percentiles=True, memory=MEMORY):
+		self.count = 0
+		self.n = 0
+		self.min = None
+		self.max = None
+		self.mean = np.float64(0)
+		self.m2 = np.float64(0)
+		self.percentiles = percentiles
+		self.memory = memory
+		self.values = []
+		self.nbytes = 0
+		self.sketch = None
+
+	def update(self, x):
+		self.count += np.size(x)
+		y = valid(x)
+		n = len(y)
+		if n == 0:
+			return
+		min_ = y.min()
+		max_ = y.max()
+		self.min = min_ if self.min is None else min(self.min, min_)
+		self.max = max_ if self.max is None else max(self.max, max_)
+		z = y.astype(np.float64, copy=False)
+		mean = z.mean()
+		dz = z - mean
+		m2 = np.dot(dz, dz)
+		delta = mean - self.mean
+		total = self.n + n
+		self.mean += delta*n/total
+		self.m2 += m2 + delta**2*self.n*n/total
+		self.n = total
+		if not self.percentiles:
+			return
+		if y.dtype.kind == 'b':
+			y = z
+		if self.sketch is None and self.nbytes + y.nbytes > self.memory:
+			self.sketch = Sketch()
+			for v in self.values:
+				self.sketch.update(v)
+			self.values = []
+		if self.sketch is not None:
+			self.sketch.update(z)
+		else:
+			self.values += [y]
+			self.nbytes += y.nbytes
+
+	def result(self):
+		res = {
+			'count': self.count,
+			'min': self.min if self.n > 0 else np.nan,
+			'max': self.max if self.n > 0 else np.nan,
+			'mean': self.mean if self.n > 0 else np.nan,
+		}
+		if not self.percentiles:
+			return res
+		if self.n == 0:
+			p = np.full(len(PERCENTILES), np.nan)
+		elif self.sketch is not None:
+			p = np.clip(self.sketch.percentile(PERCENTILES), self.min,
+				self.max)
+		else:
+			# All percentiles are selected with one partitioning of x. A
+			# single part may be a view of the data read (possibly
+			# memory-mapped read-only), so it is partitioned in place only
+			# if concatenated.
+			if len(self.values) == 1:
+				p = np.percentile(self.values[0], PERCENTILES)
+			else:
+				x = np.concatenate(self.values)
+				p = np.percentile(x, PERCENTILES, overwrite_input=True)
+		res.update({
+			'median': p[0],
+			'std': np.sqrt(self.m2/self.n) if self.n > 0 else np.nan,
+			'p68': p[1:3],
+			'p95': p[3:5],
+			'p99': p[5:7],
+		})
+		return res
+
+def valid(x):
+	# Values of x which are not missing or NaN as a 1-D array.
+	if np.ma.isMaskedArray(x):
+		y = x.compressed()
+	else:
+		y = np.ravel(x)
+	if y.dtype.kind == 'f':
+		mask = np.isnan(y)
+		if mask.any():
+			y = y[~mask]
+	return y
+
+def iter_parts(d, var):
+	# Iterate over parts of variable var along the first dimension. Lazily
+	# read variables are read from the file by parts, aligned with chunks of
+	# the variable if stored in chunks.
+	x = d.get(ds.escape(var))
+	if not isinstance(x, LazyArray) or x.ndim == 0:
+		x = ds.var(d, var)
+		if x is not None:
+			yield x
+		return
+	size = int(np.prod(x.shape[1:]))*x.dtype.itemsize
+	n = max(1, CHUNK_SIZE//max(1, size))
+	chunks = ds.meta(d, var).get('.chunks')
+	if chunks is not None and len(chunks) > 0:
+		n = max(1, n//chunks[0])*chunks[0]
+	for i in range(0, x.shape[0], n):
+		yield x.take(slice(i, i + n), 0).load()
 
 @cmd()
-def stats(var, input_, *, F=False, r={}, w={}):
+def stats(var, input_, *, fast=False, memory=MEMORY, F=False, r={}, w={}):
 	r'''
 	title: stats
 	caption: "Print variable statistics."
@@ -15,6 +188,10 @@ def stats(var, input_, *, F=False, r={}, w={}):
 		*input*: "Input file."
 		*options*: "See help for ds for global options."
 	}}
+	options: {{
+		"`fast:` *value*": "If `true`, print only `count`, `min`, `max` and `mean`. For variables with chunk statistics stored in the file (DS format) and no selection options given, they are calculated from the statistics without reading the variable data. Default: `false`."
+		"`memory:` *value*": "Maximum size in bytes of variable values held in memory for calculating exact median and percentiles. If exceeded, they are approximated from a sketch of the distribution. Default: 1073741824 (1 GiB)."
+	}}
 	"Output description": {{
 		`count`: "Number of array elements."
 		`max`: "Maximum value."
@@ -26,41 +203,47 @@ def stats(var, input_, *, F=False, r={}, w={}):
 		`p95`: "95% confidence interval calculated using percentiles."
 		`p99`: "99% confidence interval calculated using percentiles."
 	}}
-	desc: "NaNs are ignored in all statistics except for `count`. The output is formatted as [PST](https://github.com/peterkuma/pst)."
+	desc: "Missing values and NaNs are ignored in all statistics except for `count`. The variable is read in parts along its first dimension, and all statistics except for the median and percentiles are calculated in one pass. The output is formatted as [PST](https://github.com/peterkuma/pst)."
 	examples: {{
 "Print statistics of variable temperature in dataset.nc.":
 "$ ds stats temperature dataset.nc
 count: 3 min: 16.000000 max: 21.000000 mean: 18.333333 median: 18.000000 std: 2.054805 p68: { 16.640000 20.040000 } p95: { 16.100000 20.850000 } p99: { 16.020000 20.970000 }"
+"Print count, minimum, maximum and mean of variable temperature in dataset.nc.":
+"$ ds stats temperature dataset.nc fast: true
+count: 3 min: 16.000000 max: 21.000000 mean: 18.333333"
 	}}
 	'''
 	check(var, 'var', str)
 	check(input_, 'input', str)
+	check(fast, 'fast', bool)
+	check(memory, 'memory', int)
 
+	d = ds.read(input_, [], full=True, **r)
 	if not F:
-		d = ds.read(input_, [], full=True, **r)
 		var = ds.find(d, 'var', var)
-	d = ds.read(input_, [var], **r)
-	x = ds.var(d, var)
-	if x is None:
+	# Read options other than selection (such as mmap or threads) do not
+	# change the statistics.
+	if fast and \
+	   all([r.get(k) is None for k in ('sel', 'range_', 'at', 'between')]) and \
+	   var in ds.vars(d, full=True) and \
+	   '.chunk_min' in ds.meta(d, var):
+		meta = ds.meta(d, var)
+		min_ = [x for x in meta['.chunk_min'] if x is not None]
+		max_ = [x for x in meta['.chunk_max'] if x is not None]
+		n = sum(meta['.chunk_count']) - sum(meta['.chunk_nans'])
+		sys.stdout.buffer.write(misc.encode({
+			'count': int(np.prod(meta['.size'])),
+			'min': min(min_) if len(min_) > 0 else np.nan,
+			'max': max(max_) if len(max_) > 0 else np.nan,
+			'mean': sum(meta['.chunk_sum'])/n if n > 0 else np.nan,
+		}) + b'\n')
 		return
-	x = x.flatten()
-	count = len(x)
-	min_ = np.nanmin(x)
-	max_ = np.nanmax(x)
-	mean = np.nanmean(x)
-	median = np.nanmedian(x)
-	std = np.nanstd(x)
-	percentile = [[0.5*(100 - p), 100 - 0.5*(100 - p)] for p in [68, 95, 99]]
-	p68, p95, p99 = np.nanpercentile(x, percentile)
-
-	sys.stdout.buffer.write(misc.encode({
-		'count': count,
-		'min': min_,
-		'max': max_,
-		'mean': mean,
-		'median': median,
-		'std': std,
-		'p68': p68,
-		'p95': p95,
-		'p99': p99,
-	}) + b'\n')
+	d = ds.read(input_, [var], lazy=True, **r)
+	if not ds.require(d, 'var', var) or d.get(ds.escape(var)) is None:
+		return
+	if ds.type(d, var) in ('str', 'unicode'):
+		raise ValueError('%s: statistics of string variables are not supported' % var)
+	s = Stats(percentiles=(not fast), memory=memory)
+	for x in iter_parts(d, var):
+		s.update(x)
+	sys.stdout.buffer.write(misc.encode(s.result()) + b'\n')
@@ -0,0 +1,95 @@
+import bisect
+from ds_format import misc
+
+def is_var_key(k):
+	return isinstance(k, str) and not k.startswith('.')
+
+# Dataset dictionary with an index of variable names and a cache of dimension
+# sizes. The index is a sorted list of unescaped variable names, which is
+# updated when a variable is added or removed. The dimension sizes and the
+# result of validation are cached until the dataset is modified. Modifications
+# of the metadata through the ds functions are also tracked, but metadata
+# modified in place by other code require a call to invalidate.
+class Dataset(dict):
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.reindex()
+
+	def reindex(self):
+		self._names = sorted([misc.unescape(k) for k in self if is_var_key(k)])
+		self._names_set = set(self._names)
+		self.invalidate()
+
+	def invalidate(self):
+		self._dims = {}
+		self._valid = False
+
+	def has_var(self, name):
+		return name in self._names_set
+
+	def var_names(self):
+		return list(self._names)
+
+	def _add(self, k):
+		if not is_var_key(k):
+			return
+		name = misc.unescape(k)
+		if name not in self._names_set:
+			bisect.insort(self._names, name)
+			self._names_set.add(name)
+
+	def _remove(self, k):
+		if not is_var_key(k):
+			return
+		name = misc.unescape(k)
+		if name in self._names_set:
+			del self._names[bisect.bisect_left(self._names, name)]
+			self._names_set.remove(name)
+
+	def __setitem__(self, k, v):
+		super().__setitem__(k, v)
+		self._add(k)
+		self.invalidate()
+
+	def __delitem__(self, k):
+		super().__delitem__(k)
+		self._remove(k)
+		self.invalidate()
+
+	def pop(self, k, *default):
+		x = super().pop(k, *default)
+		self._remove(k)
+		self.invalidate()
+		return x
+
+	def popitem(self):
+		k, v = super().popitem()
+		self._remove(k)
+		self.invalidate()
+		return k, v
+
+	def setdefault(self, k, default=None):
+		if k not in self:
+			self[k] = default
+		return self[k]
+
+	def update(self, *args, **kwargs):
+		for k, v in dict(*args, **kwargs).items():
+			self[k] = v
+
+	def __ior__(self, other):
+		self.update(other)
+		return self
+
+	def clear(self):
+		super().clear()
+		self.reindex()
+
+	def copy(self):
+		return Dataset(self)
+
+	def __reduce__(self):
+		return (Dataset, (dict(self),))
+
+	def __repr__(self):
+		return 'Dataset(%s)' % super().__repr__()
@@ -4,6 +4,11 @@ from ds_format import misc
 
 READ_EXT = ['csv', 'tsv', 'tab']
 WRITE_EXT = ['csv', 'tsv', 'tab']
+READ_OPTS = []
+WRITE_OPTS = ['opts']
+# The whole file is parsed to read any part of it, so variables are not read
+# lazily.
+LAZY = False
 
 def convert_read(x):
 	for f in [int, float]:
@@ -25,19 +30,43 @@ def read(filename, variables=None, sel=None, full=False, jd=False, opts={}):
 	x = []
 	sep = opts.get('sep')
 	if sep is None: sep = '\t' if filename.endswith(('tsv', 'tab')) else ','
+	# Only the rows in a range selected along the dimension i are converted
+	# and reading stops after the last row. Columns which are not read are
+	# not converted, unless their type is needed for the metadata.
+	s = sel.get('i') if sel is not None and not full else None
+	if isinstance(s, slice) and s.step in (None, 1) and \
+	   (s.start is None or s.start >= 0) and \
+	   s.stop is not None and s.stop >= 0:
+		start = 0 if s.start is None else s.start
+		stop = s.stop
+		sel = {k: v for k, v in sel.items() if k != 'i'}
+	else:
+		start, stop = 0, None
 	with open(filename) as f:
 		reader = csv.reader(f, delimiter=sep)
+		k = 0
 		for row in reader:
 			if header is None:
 				header = row
 				ncols = len(header)
 				x = [[] for i in range(ncols)]
+				cols = [
+					j for j in range(ncols)
+					if full or variables is None or header[j] in variables
+				]
+				continue
+			if stop is not None and k >= stop:
+				break
+			k += 1
+			if k <= start:
 				continue
-			for j in range(ncols):
+			for j in cols:
 				x[j].append(convert_read(row[j]) if len(row) > j else None)
 	d = {}
 	for j in range(ncols):
 		var = header[j]
+		if variables is not None and var not in variables and not full:
+			continue
 		ds.var(d, var, x[j])
 		meta = {
 			'.dims': ['i'],
@@ -1,14 +1,29 @@
+import os
 import sys
 import json
-from copy import copy
+import itertools
+import zlib
+import lzma
+import bz2
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from copy import copy, deepcopy
+from contextlib import contextmanager
+from types import SimpleNamespace
 import numpy as np
 import ds_format as ds
 from ds_format import misc
 
-VERSION = '1.0'
+VERSION = '1.1'
+VERSIONS = [b'1.0', b'1.1']
 
 READ_EXT = ['ds']
 WRITE_EXT = ['ds']
+READ_OPTS = ['mmap', 'fixed_str', 'threads']
+WRITE_OPTS = ['chunks', 'compression', 'threads']
+# The driver releases the GIL while reading, and can read files in parallel
+# threads.
+THREAD_SAFE = True
 
 TYPE_SIZE = {
 	'int8': 8,
@@ -27,6 +42,32 @@ TYPE_SIZE = {
 	None: 0,
 }
 
+# Target size of automatically chosen chunks in bytes.
+CHUNK_SIZE = 1 << 20
+
+# Size of blocks in bytes in which non-contiguous and masked arrays are
+# written.
+BLOCK_SIZE = 1 << 22
+
+CHUNK_STATS = ['.chunk_min', '.chunk_max', '.chunk_count', '.chunk_nans',
+	'.chunk_sum']
+
+CHUNK_META = ['.chunks', '.chunk_offsets', '.chunk_lens', '.chunk_spaces',
+	'.compression'] + CHUNK_STATS
+
+FILTERS = ['delta', 'shuffle']
+
+# Positional I/O, which allows reading and writing from multiple threads on
+# the same file descriptor.
+PIO = hasattr(os, 'preadv') and hasattr(os, 'pwrite')
+
+CODECS = {
+	'zlib': (zlib.compressobj, zlib.decompress),
+	'lzma': (lzma.LZMACompressor, lzma.decompress),
+	'bz2': (bz2.BZ2Compressor, bz2.decompress),
+	'none': (None, None),
+}
+
 class JSONEncoder(json.JSONEncoder):
 	def default(self, obj):
 		if isinstance(obj, np.generic):
@@ -35,126 +76,614 @@ class JSONEncoder(json.JSONEncoder):
 			return list(obj)
 		return json.JSONEncoder(self, obj)
 
-def read(filename, variables=None, sel=None, full=False, jd=False):
-	d = {}
-	with open(filename, 'rb') as f:
-		version_s = f.readline()
-		if not version_s.startswith(b'ds-'):
-			raise IOError('invalid format version string')
-		version = version_s[3:-1]
-		if version != b'1.0':
-			raise IOError('unsupported format version')
-		header = f.readline()
-		meta_s = header.decode('utf-8')
-		meta = json.loads(meta_s)
-		d['.'] = meta
-		data_offset = len(version_s) + len(header)
-		if variables is not None and not full:
-			meta = {k: v for k, v in meta.items() if k in variables}
-		for name in meta.keys():
-			if name.startswith('.') or \
-			   variables is not None and name not in variables:
-				continue
-			var = meta[name]
-			offset = var.get('.offset', 0)
-			type_ = var.get('.type', 'float64')
-			len_ = var.get('.len', 0)
-			size = var.get('.size', [])
-			endian = var.get('.endian', 'b')
-			missing = var.get('.missing', False)
-			dt = misc.type_to_dtype(type_)
-			if dt is None:
-				continue
-			byteorder = {
-				'l': '<',
-				'b': '>',
-			}[endian]
-			count = 0 if size is None else int(np.prod(size))
-			mask_len = int(np.ceil(count/8)) if missing else 0
-
-			if missing and count > 0:
-				f.seek(data_offset + offset)
-				mask = np.fromfile(f, 'uint8', count=mask_len)
-				mask = np.unpackbits(mask)[:count].astype(bool)
-				mask = mask.reshape(size)
-				count2 = np.sum(~mask)
-			else:
-				count2 = count
+def pread(f, pos, n):
+	buf = np.empty(n, 'uint8')
+	if PIO:
+		m = 0
+		while m < n:
+			k = os.preadv(f.fileno(), [buf[m:]], pos + m)
+			if k == 0:
+				break
+			m += k
+	else:
+		f.seek(pos)
+		m = f.readinto(buf)
+	return buf[:m]
 
-			if count == 0:
-				data = None
-			else:
-				var_len = int(count2*TYPE_SIZE[type_]/8)
-				f.seek(data_offset + offset + mask_len)
-				if type_ == 'bool':
-					data = np.fromfile(f, 'uint8', count=var_len)
-					data = np.unpackbits(data)[:count2]
-					data = data.astype(bool)
-				elif type_ in ('str', 'unicode'):
-					dt_slen = np.dtype('uint64').newbyteorder(byteorder)
-					slen = np.fromfile(f, dt_slen, count=count2)
-					data = []
-					for slen1 in slen:
-						if type_ == 'str':
-							data += [f.read(slen1)]
-						else:
-							data += [f.read(slen1).decode('utf-8')]
-					data = np.array(data, 'O')
-				else:
-					dt = dt.newbyteorder(byteorder)
-					data = np.fromfile(f, dt, count=count2)
+def pwrite(f, bufs, pos):
+	for buf in bufs:
+		buf = memoryview(buf).cast('B')
+		while len(buf) > 0:
+			k = os.pwrite(f.fileno(), buf, pos)
+			buf = buf[k:]
+			pos += k
 
-				if missing:
-					data2 = np.zeros(size, dtype=dt)
-					data2[~mask] = data
-					data = np.ma.array(data2, mask=mask)
-				else:
-					data = data.reshape(size)
-
-				if size == []:
-					data = data[()]
-
-			if sel is not None:
-				#s = ds.misc.sel_slice(sel, dims)
-				#mask = mask[s]
-				dims = ds.dims(d, name)
-				s = ds.misc.sel_slice(sel, dims)
-				dims = ds.misc.sel_dims(sel, dims)
-				var['.dims'] = dims
-				data = data[s]
-			d[name] = data
+def read_array(f, mm, pos, dtype, count):
+	dtype = np.dtype(dtype)
+	if mm is None:
+		return pread(f, pos, count*dtype.itemsize).view(dtype)
+	return mm[pos:(pos + count*dtype.itemsize)].view(dtype)
+
+def read_bytes(f, mm, pos, n):
+	if mm is None:
+		return memoryview(pread(f, pos, n))
+	return memoryview(mm[pos:(pos + n)])
+
+def uint_dtype(dtype):
+	return np.dtype('uint%d' % (dtype.itemsize*8)).newbyteorder(
+		dtype.byteorder)
+
+def filter_data(data, filters):
+	dtype = data.dtype
+	buf = np.ascontiguousarray(data)
+	for x in filters:
+		if x == 'delta':
+			dt_u = uint_dtype(dtype)
+			u = buf.view(dt_u).astype(dt_u.newbyteorder('='))
+			u[1:] -= u[:-1].copy()
+			buf = u.astype(dt_u)
+		elif x == 'shuffle':
+			buf = buf.view('uint8').reshape(-1, dtype.itemsize).T.flatten()
+	return buf
+
+def unfilter_data(buf, dtype, filters):
+	for x in reversed(filters):
+		if x == 'shuffle':
+			buf = buf.reshape(dtype.itemsize, -1).T.flatten()
+		elif x == 'delta':
+			dt_u = uint_dtype(dtype)
+			u = np.cumsum(buf.view(dt_u), dtype=dt_u.newbyteorder('='))
+			buf = u.astype(dt_u).view('uint8')
+	return buf.view(dtype)
+
+def decode_str(slen, payload, type_, fixed_str=False):
+	if fixed_str:
+		n = max(int(np.max(slen, initial=0)), 1)
+		x = np.zeros((len(slen), n), 'uint8')
+		x[np.arange(n) < slen[:,None]] = np.frombuffer(payload, 'uint8')
+		x = x.view('S%d' % n).reshape(len(slen))
+		if type_ == 'str':
+			return x
+		elif bytes(payload).isascii():
+			return x.astype('U%d' % n)
+		else:
+			return np.char.decode(x, 'utf-8')
+	payload = bytes(payload)
+	end = np.cumsum(slen).tolist()
+	start = [0] + end[:-1]
+	if type_ == 'unicode' and payload.isascii():
+		payload = payload.decode('ascii')
+		type_ = 'str'
+	if type_ == 'str':
+		x = [payload[i:j] for i, j in zip(start, end)]
+	else:
+		x = [payload[i:j].decode('utf-8') for i, j in zip(start, end)]
+	data = np.empty(len(x), 'O')
+	data[:] = x
+	return data
+
+def encode_str(data):
+	if data.dtype.kind == 'U':
+		data = np.char.encode(data, 'utf-8')
+	if data.dtype.kind == 'S':
+		slen = np.char.str_len(data).astype(np.uint64)
+		n = data.dtype.itemsize
+		x = np.ascontiguousarray(data).view('uint8').reshape(len(data), n)
+		return slen, x[np.arange(n) < slen[:,None]]
+	x = list(data)
+	try: payload = ''.join(x).encode('utf-8')
+	except TypeError: payload = None
+	if payload is not None and len(payload) == sum(map(len, x)):
+		slen = np.fromiter(map(len, x), np.uint64, len(x))
+		return slen, payload
+	x = [y.encode('utf-8') if isinstance(y, str) else bytes(y) for y in x]
+	slen = np.fromiter(map(len, x), np.uint64, len(x))
+	return slen, b''.join(x)
+
+def read_block(f, mm, pos, type_, shape, missing, byteorder, filters=[],
+	fixed_str=False):
+	dt = misc.type_to_dtype(type_)
+	count = int(np.prod(shape))
+	mask_len = int(np.ceil(count/8)) if missing else 0
+
+	if missing:
+		mask = read_array(f, mm, pos, 'uint8', mask_len)
+		mask = np.unpackbits(mask)[:count].astype(bool)
+		mask = mask.reshape(shape)
+		count2 = int(np.sum(~mask))
+	else:
+		count2 = count
+
+	var_len = int(np.ceil(count2*TYPE_SIZE[type_]/8))
+	pos += mask_len
+	if type_ == 'bool':
+		data = read_array(f, mm, pos, 'uint8', var_len)
+		data = np.unpackbits(data)[:count2]
+		data = data.astype(bool)
+	elif type_ in ('str', 'unicode'):
+		dt_slen = np.dtype('uint64').newbyteorder(byteorder)
+		slen = read_array(f, mm, pos, dt_slen, count2)
+		payload = read_bytes(f, mm, pos + slen.nbytes, int(np.sum(slen)))
+		data = decode_str(slen, payload, type_, fixed_str)
+		dt = data.dtype
+	else:
+		dt = dt.newbyteorder(byteorder)
+		if len(filters) > 0:
+			data = read_array(f, mm, pos, 'uint8', count2*dt.itemsize)
+			data = unfilter_data(data, dt, filters)
+		else:
+			data = read_array(f, mm, pos, dt, count2)
+
+	if missing:
+		data2 = np.zeros(shape, dtype=dt)
+		data2[~mask] = data
+		return np.ma.array(data2, mask=mask)
+	return data.reshape(shape)
+
+def chunk_sel(s, n, c):
+	# Determine chunks along a dimension of size n with chunk size c needed
+	# for a selector s, and the selector relative to the needed chunks.
+	if isinstance(s, slice):
+		start, stop, step = s.indices(n)
+		r = range(start, stop, step)
+		if len(r) == 0:
+			return [], slice(0, 0)
+		k0 = min(r[0], r[-1])//c
+		k1 = max(r[0], r[-1])//c
+		start -= k0*c
+		stop -= k0*c
+		return list(range(k0, k1 + 1)), \
+			slice(start, stop if stop >= 0 else None, step)
+	ii = np.asarray(s)
+	if ii.dtype == np.bool_:
+		ii = np.nonzero(ii)[0]
+	ii = np.where(ii < 0, ii + n, ii)
+	kk = np.unique(ii//c)
+	jj = np.searchsorted(kk, ii//c)*c + ii % c
+	return kk.tolist(), jj if ii.ndim > 0 else int(jj)
+
+def is_contiguous(var):
+	size = var.get('.size', [])
+	chunks = var.get('.chunks')
+	if chunks is None:
+		return True
+	if '.compression' in var:
+		return False
+	if list(chunks[1:]) != list(size[1:]):
+		return False
+	offsets = var['.chunk_offsets']
+	lens = var['.chunk_lens']
+	return all(
+		offsets[i] + lens[i] == offsets[i + 1]
+		for i in range(len(offsets) - 1)
+	)
+
+def read_chunked(f, mm, data_offset, var, s, fixed_str=False):
+	type_ = var.get('.type', 'float64')
+	size = var['.size']
+	chunks = var['.chunks']
+	missing = var.get('.missing', False)
+	byteorder = {'l': '<', 'b': '>'}[var.get('.endian', 'b')]
+	offsets = var['.chunk_offsets']
+	lens = var['.chunk_lens']
+	compression = var.get('.compression', [])
+	filters = compression[:-1]
+	decompress = CODECS[compression[-1]][1] if len(compression) > 0 \
+		else None
+	grid = [int(np.ceil(n/c)) for n, c in zip(size, chunks)]
+	if s is None:
+		s = tuple([slice(None)]*len(size))
+	kk, s2 = zip(*[chunk_sel(s1, n, c) for s1, n, c in zip(s, size, chunks)])
+	shape = [
+		0 if len(k) == 0 else (len(k) - 1)*c + min(c, n - k[-1]*c)
+		for k, n, c in zip(kk, size, chunks)
+	]
+	jjj = list(itertools.product(*[enumerate(k) for k in kk]))
+	ii = [np.ravel_multi_index([j[1] for j in jj], grid) for jj in jjj]
+	chunk_shapes = [
+		[min(c, n - j[1]*c) for j, n, c in zip(jj, size, chunks)]
+		for jj in jjj
+	]
+	if len(compression) == 0:
+		blocks = (
+			read_block(f, mm, data_offset + offsets[i], type_, chunk_shape,
+				missing, byteorder, fixed_str=fixed_str)
+			for i, chunk_shape in zip(ii, chunk_shapes)
+		)
+	else:
+		def decode(args):
+			buf, chunk_shape = args
+			if decompress is not None:
+				buf = decompress(buf)
+			buf = np.frombuffer(buf, 'uint8')
+			return read_block(None, buf, 0, type_, chunk_shape, missing,
+				byteorder, filters, fixed_str)
+		bufs = [
+			read_bytes(f, mm, data_offset + offsets[i], lens[i])
+			for i in ii
+		]
+		args = list(zip(bufs, chunk_shapes))
+		if len(args) > 1:
+			with ThreadPoolExecutor() as ex:
+				blocks = list(ex.map(decode, args))
+		else:
+			blocks = [decode(x) for x in args]
+	dt = misc.type_to_dtype(type_)
+	if type_ in ('str', 'unicode') and fixed_str:
+		blocks = list(blocks)
+		dt = np.result_type(*[block.dtype for block in blocks]) \
+			if len(blocks) > 0 else np.dtype('S1')
+	elif type_ not in ('bool', 'str', 'unicode'):
+		dt = dt.newbyteorder(byteorder)
+	data = np.zeros(shape, dt)
+	if missing:
+		data = np.ma.array(data, mask=np.zeros(shape, bool))
+	for jj, chunk_shape, block in zip(jjj, chunk_shapes, blocks):
+		dst = tuple([
+			slice(j[0]*c, j[0]*c + n1)
+			for j, c, n1 in zip(jj, chunks, chunk_shape)
+		])
+		data[dst] = block
+	return misc.sel_apply(data, s2)
+
+def read_header(f):
+	version_s = f.readline()
+	if not version_s.startswith(b'ds-'):
+		raise IOError('invalid format version string')
+	version = version_s[3:-1]
+	if version not in VERSIONS:
+		raise IOError('unsupported format version')
+	header = f.readline()
+	meta_s = header.decode('utf-8')
+	meta = json.loads(meta_s)
+	data_offset = len(version_s) + len(header)
+	return meta, data_offset
+
+def read_var(f, mm, data_offset, var, s=None, fixed_str=False):
+	offset = var.get('.offset', 0)
+	type_ = var.get('.type', 'float64')
+	size = var.get('.size', [])
+	missing = var.get('.missing', False)
+	byteorder = {
+		'l': '<',
+		'b': '>',
+	}[var.get('.endian', 'b')]
+	count = 0 if size is None else int(np.prod(size))
+	if count == 0:
+		return None
+	elif mm is not None and not missing and \
+		type_ not in ('bool', 'str', 'unicode') and \
+		is_contiguous(var):
+		if '.chunks' in var:
+			offset = var['.chunk_offsets'][0]
+		dt = misc.type_to_dtype(type_).newbyteorder(byteorder)
+		data = read_array(f, mm, data_offset + offset, dt, count)
+		data = data.reshape(size)
+	elif '.chunks' in var:
+		return read_chunked(f, mm, data_offset, var, s, fixed_str)
+	else:
+		data = read_block(f, mm, data_offset + offset, type_, size,
+			missing, byteorder, fixed_str=fixed_str)
+	return misc.sel_apply(data, s) if s is not None else data
+
+@contextmanager
+def open_(filename, mmap=False, fixed_str=False, threads=None):
+	misc.check(threads, 'threads', [int, None])
+	with open(filename, 'rb') as f:
+		meta, data_offset = read_header(f)
+		yield SimpleNamespace(
+			f=f,
+			mm=(np.memmap(filename, 'uint8', mode='r') if mmap else None),
+			meta=meta,
+			data_offset=data_offset,
+			fixed_str=fixed_str,
+			threads=threads,
+		)
+
+def read_handle(h, variables=None, sel=None, full=False, jd=False):
+	f, mm, data_offset = h.f, h.mm, h.data_offset
+	threads = h.threads
+	d = {}
+	meta = deepcopy(h.meta)
+	d['.'] = meta
+	if variables is not None and not full:
+		meta = {k: v for k, v in meta.items() if k in variables}
+	jobs = []
+	for name in meta.keys():
+		if name.startswith('.') or \
+		   variables is not None and name not in variables:
+			continue
+		var = meta[name]
+		type_ = var.get('.type', 'float64')
+		if misc.type_to_dtype(type_) is None:
+			continue
+		dims = ds.dims(d, name)
+		s = ds.misc.sel_slice(sel, dims) if sel is not None else None
+		jobs += [(name, var, dims, s)]
+	def read1(job):
+		name, var, dims, s = job
+		return read_var(f, mm, data_offset, var, s, h.fixed_str)
+	if threads is not None and threads > 1 and len(jobs) > 1 and \
+	   (PIO or mm is not None):
+		with ThreadPoolExecutor(threads) as ex:
+			res = list(ex.map(read1, jobs))
+	else:
+		res = [read1(job) for job in jobs]
+	for (name, var, dims, s), data in zip(jobs, res):
+		if data is not None and var.get('.size', []) == []:
+			data = data[()]
+		if sel is not None:
+			var['.dims'] = ds.misc.sel_dims(sel, dims)
+		d[name] = data
 	if jd:
 		for var in ds.vars(d):
 			misc.process_cf_time_var(d, var)
 	return d
 
-def write(filename, d):
+def read(filename, variables=None, sel=None, full=False, jd=False,
+	mmap=False, fixed_str=False, threads=None):
+	with open_(filename, mmap, fixed_str, threads) as h:
+		return read_handle(h, variables, sel, full, jd)
+
+def auto_chunks(data, type_):
+	if data.ndim == 0:
+		return None
+	row_size = int(np.prod(data.shape[1:]))*max(TYPE_SIZE[type_]//8, 1)
+	n = max(CHUNK_SIZE//max(row_size, 1), 1)
+	if n >= data.shape[0]:
+		return None
+	return [n] + list(data.shape[1:])
+
+def get_chunks(data, type_, dims, chunks):
+	if chunks is None:
+		return auto_chunks(data, type_)
+	var_chunks = [
+		max(min(chunks.get(dim, n), n), 1)
+		for dim, n in zip(dims, data.shape)
+	]
+	if var_chunks == list(data.shape):
+		return None
+	return var_chunks
+
+def iter_chunks(size, chunks):
+	grid = [int(np.ceil(n/c)) for n, c in zip(size, chunks)]
+	for k in np.ndindex(*grid):
+		yield tuple([
+			slice(k1*c, min((k1 + 1)*c, n))
+			for k1, n, c in zip(k, size, chunks)
+		])
+
+def block_len(data, var):
+	count = data.size
+	n = 0
+	if var['.missing']:
+		n += int(np.ceil(count/8))
+	count2 = count - int(np.count_nonzero(np.ma.getmask(data))) \
+		if var['.missing'] else count
+	dtype = data.dtype
+	if dtype.kind in ('O', 'U', 'S'):
+		# Upper bound of the length of the strings encoded as UTF-8.
+		x = np.ma.getdata(data)[~np.ma.getmaskarray(data)]
+		if dtype.kind == 'O':
+			n += int(8*count2 + 4*sum(map(len, x)))
+		else:
+			w = 4 if dtype.kind == 'U' else 1
+			n += int(8*count2 + w*np.sum(np.char.str_len(x)))
+	else:
+		n += int(np.ceil(TYPE_SIZE[var['.type']]*count2/8))
+	return n
+
+def chunk_stats(data):
+	# Minimum, maximum, number of non-missing values, number of NaNs and sum
+	# of the non-missing values of a chunk.
+	if isinstance(data, np.ma.MaskedArray):
+		data = np.ma.getdata(data)[~np.ma.getmaskarray(data)]
+	count = data.size
+	nans = int(np.count_nonzero(np.isnan(data))) \
+		if data.dtype.kind == 'f' else 0
+	if nans > 0:
+		data = data[~np.isnan(data)]
+	if data.size == 0:
+		return None, None, count, nans, 0
+	return data.min(), data.max(), count, nans, \
+		float(np.sum(data, dtype='float64'))
+
+def merge_chunk_stats(a, b):
+	# Chunk statistics of two parts of a chunk.
+	def merge(f, x, y):
+		return y if x is None else x if y is None else f(x, y)
+	return merge(min, a[0], b[0]), merge(max, a[1], b[1]), a[2] + b[2], \
+		a[3] + b[3], a[4] + b[4]
+
+def set_chunk_stats(var, i, stats):
+	for k, x in zip(CHUNK_STATS, stats):
+		if i == 0:
+			var[k] = []
+		var[k] += [x]
+
+def max_compressed_len(n):
+	return n + n//8 + 1024
+
+def iter_flat(data):
+	# Iterate over the flattened data in C order. Contiguous arrays are
+	# returned as a single view. Non-contiguous and masked arrays are
+	# copied in blocks of about BLOCK_SIZE bytes.
+	if not isinstance(data, np.ma.MaskedArray) and data.flags.c_contiguous:
+		yield data.reshape(-1)
+		return
+	if data.ndim == 0:
+		yield data.flatten()
+		return
+	row = data[0].size if data.ndim > 1 else 1
+	if row*data.itemsize > BLOCK_SIZE:
+		for x in data:
+			yield from iter_flat(x)
+		return
+	k = max(BLOCK_SIZE//max(row*data.itemsize, 1), 1)
+	for i in range(0, data.shape[0], k):
+		yield data[i:(i + k)].flatten()
+
+def iter_values(data, missing):
+	# Iterate over blocks of values which are not missing.
+	for x in iter_flat(data):
+		if missing:
+			yield np.ma.getdata(x)[~np.ma.getmaskarray(x)]
+		else:
+			yield np.ma.getdata(x)
+
+def join_values(data, missing):
+	xx = list(iter_values(data, missing))
+	if len(xx) == 0:
+		return np.ma.getdata(data).reshape(-1)
+	if len(xx) == 1:
+		return xx[0]
+	x = np.concatenate(xx)
+	# Concatenation converts numerical types to the native byte order.
+	return x.astype(xx[0].dtype, copy=False) if x.dtype.kind in 'biuf' \
+		else x
+
+def pack_bits(blocks):
+	# Bitpack a sequence of blocks of boolean values as if they were one.
+	rest = None
+	for x in blocks:
+		if rest is not None:
+			x = np.concatenate([rest, x])
+		n = len(x)//8*8
+		yield np.packbits(x[:n])
+		rest = x[n:]
+	if rest is not None and len(rest) > 0:
+		yield np.packbits(rest)
+
+def encode_block(data, var):
+	filters = var.get('.compression', [])[:-1]
+	if var['.missing']:
+		yield from pack_bits(
+			np.ma.getmaskarray(x) for x in iter_flat(data)
+		)
+	if var['.type'] in ['str', 'unicode']:
+		yield from encode_str(join_values(data, var['.missing']))
+	elif var['.type'] == 'bool':
+		yield from pack_bits(iter_values(data, var['.missing']))
+	elif len(filters) > 0:
+		yield filter_data(join_values(data, var['.missing']), filters)
+	else:
+		yield from iter_values(data, var['.missing'])
+
+def compress_block(bufs, codec):
+	compressor = CODECS[codec][0]
+	if compressor is None:
+		yield from bufs
+		return
+	c = compressor()
+	for buf in bufs:
+		yield c.compress(buf)
+	yield c.flush()
+
+def encode_compress_block(data, var):
+	bufs = encode_block(data, var)
+	if '.compression' in var:
+		bufs = compress_block(bufs, var['.compression'][-1])
+	return bufs
+
+def encode_compress_block_list(data, var):
+	return list(encode_compress_block(data, var))
+
+def write_block(f, data, var):
+	bufs = encode_compress_block(data, var)
+	n = 0
+	for buf in bufs:
+		f.write(buf)
+		n += memoryview(buf).nbytes
+	return n
+
+def parse_compression(compression):
+	if compression is None:
+		return [], 'none'
+	x = [compression] if isinstance(compression, str) else compression
+	for y in x:
+		if y not in FILTERS and y not in CODECS:
+			raise ValueError('invalid compression "%s"' % y)
+	codecs = [y for y in x if y in CODECS]
+	if len(codecs) > 1:
+		raise ValueError('only one compression codec can be specified')
+	filters = [y for y in FILTERS if y in x]
+	codec = codecs[0] if len(codecs) > 0 else 'none'
+	return filters, codec
+
+def iter_blocks(d, meta):
+	# Iterate over variables or their chunks in the order they are written.
+	for name in ds.vars(d):
+		if ds.escape(name) not in meta:
+			continue
+		var = meta[ds.escape(name)]
+		data = ds.var(d, name)
+		if data is None:
+			continue
+		if '.chunks' in var:
+			for i, s in enumerate(iter_chunks(data.shape, var['.chunks'])):
+				yield var, i, data[s]
+		else:
+			yield var, None, data
+
+def set_block(var, i, offset, n):
+	# Set the offset and length of a variable or its chunk i.
+	if i is None or i == 0:
+		var['.offset'] = offset
+		var['.len'] = 0
+	if i is not None:
+		var['.chunk_offsets'][i] = offset
+		var['.chunk_lens'][i] = n
+	var['.len'] += n
+
+def write_parallel(f, blocks, pos, threads):
+	# Encode and compress blocks in parallel, and write them with pwrite at
+	# offsets following each other. The number of blocks in progress is
+	# limited to bound memory use.
+	body_pos = pos
+	encoding = deque()
+	writing = deque()
+	with ThreadPoolExecutor(threads) as ex:
+		def next_block():
+			var, i, fut = encoding.popleft()
+			bufs = fut.result()
+			n = sum([memoryview(buf).nbytes for buf in bufs])
+			set_block(var, i, pos - body_pos, n)
+			writing.append(ex.submit(pwrite, f, bufs, pos))
+			while len(writing) > threads:
+				writing.popleft().result()
+			return n
+		for var, i, data in blocks:
+			encoding.append((var, i,
+				ex.submit(encode_compress_block_list, data, var)))
+			if len(encoding) > threads:
+				pos += next_block()
+		while len(encoding) > 0:
+			pos += next_block()
+		while len(writing) > 0:
+			writing.popleft().result()
+
+def write(filename, d, chunks=None, compression=None, threads=None):
 	ds.validate(d)
+	misc.check(threads, 'threads', [int, None])
+	misc.check(chunks, 'chunks', [[dict, str, int], None])
+	misc.check(compression, 'compression', [str, [list, str], None])
+	filters, codec = parse_compression(compression)
+	version = '1.0'
 	offset = 0
 	meta = {}
 	for name in ds.vars(d):
 		var = copy(ds.meta(d, name))
+		for k in CHUNK_META:
+			var.pop(k, None)
 		data = ds.var(d, name)
 		dtype = None if data is None else data.dtype
 		var['.size'] = None if data is None else list(data.shape)
-		count = 0 if var['.size'] is None else np.prod(var['.size'])
 		var['.offset'] = offset
 		var['.len'] = 0
 		var['.type'] = var.get('.type') if dtype is None else \
 			misc.dtype_to_type(dtype, data)
 		var['.missing'] = bool(isinstance(data, np.ma.MaskedArray) and \
 			np.ma.is_masked(data))
-		if var['.missing']:
-			var['.len'] += int(np.ceil(count/8))
-		count2 = np.sum(~data.mask) if var['.missing'] else count
-		if dtype is not None and dtype.kind in ('U', 'O'):
-			var['.len'] += int(8*count2 + \
-				sum([len(str(x).encode('utf-8')) for x in data.flatten()]))
-		elif dtype is not None and dtype.kind == 'S':
-			var['.len'] += int(8*count2 + \
-				sum([len(x) for x in data.flatten()]))
-		else:
-			var['.len'] += int(np.ceil(TYPE_SIZE[var['.type']]*count2/8))
 		if dtype is not None and dtype.kind in ('U', 'S', 'O'):
 			var['.endian'] = sys.byteorder[0]
 		elif var['.type'] == 'bool':
@@ -166,39 +695,534 @@ def write(filename, d):
 				'=': sys.byteorder[0],
 				'|': 'b',
 			}[dtype.byteorder]
+		var_chunks = None
+		if data is not None and data.size > 0:
+			var_chunks = get_chunks(data, var['.type'], ds.dims(d, name),
+				chunks)
+			if data.ndim > 0 and (codec != 'none' or len(filters) > 0):
+				var_filters = filters \
+					if var['.type'] not in ('bool', 'str', 'unicode') \
+					else []
+				if codec != 'none' or len(var_filters) > 0:
+					var['.compression'] = var_filters + [codec]
+					if var_chunks is None:
+						var_chunks = list(data.shape)
+		if var_chunks is None:
+			if data is not None:
+				var['.len'] = block_len(data, var)
+		else:
+			var['.chunks'] = var_chunks
+			var['.chunk_offsets'] = []
+			var['.chunk_lens'] = []
+			for i, s in enumerate(iter_chunks(data.shape, var_chunks)):
+				n = block_len(data[s], var)
+				if var['.type'] not in ('bool', 'str', 'unicode'):
+					set_chunk_stats(var, i, chunk_stats(data[s]))
+				if '.compression' in var:
+					n = max_compressed_len(n)
+				var['.chunk_offsets'] += [offset + var['.len']]
+				var['.chunk_lens'] += [n]
+				var['.len'] += n
+			version = VERSION
 		offset += var['.len']
 		meta[ds.escape(name)] = var
 	meta['.'] = ds.meta(d, '')
-	meta_s = json.dumps(meta, cls=JSONEncoder)
+	# The header is written with upper bounds of the lengths of compressed
+	# chunks, and rewritten with the actual lengths after writing the data.
+	header_len = len(json.dumps(meta, cls=JSONEncoder))
 	with open(filename, 'wb') as f:
-		header = \
-			b'ds-%b\n' % VERSION.encode('utf-8') + \
-			meta_s.encode('utf-8') + \
-			b'\n'
-		f.write(header)
+		f.write(b'ds-%b\n' % version.encode('utf-8'))
+		header_pos = f.tell()
+		f.write(b' '*header_len + b'\n')
+		body_pos = f.tell()
+		blocks = iter_blocks(d, meta)
+		if threads is not None and threads > 1 and PIO:
+			f.flush()
+			write_parallel(f, blocks, body_pos, threads)
+		else:
+			for var, i, data in blocks:
+				pos = f.tell() - body_pos
+				set_block(var, i, pos, write_block(f, data, var))
+		meta_s = json.dumps(meta, cls=JSONEncoder)
+		f.seek(header_pos)
+		f.write(meta_s.encode('utf-8').ljust(header_len))
+
+def append_chunks(var, k):
+	# Chunks of a variable being appended along the axis k, with the axis
+	# split into chunks of about CHUNK_SIZE bytes.
+	size = var['.size']
+	row_size = int(np.prod([n for i, n in enumerate(size) if i != k]))* \
+		max(TYPE_SIZE[var['.type']]//8, 1)
+	chunks = list(size)
+	chunks[k] = max(CHUNK_SIZE//max(row_size, 1), 1)
+	return chunks
+
+def append_space(n, rows, c):
+	# Space in bytes allocated for a chunk of n bytes with rows rows along the
+	# append axis out of c. The space of a partial chunk is doubled, up to
+	# about the size of the complete chunk, so that it is rewritten in place
+	# by later appends and relocated only a logarithmic number of times,
+	# while small files stay small.
+	if rows >= c:
+		return n
+	full = int(np.ceil(n*c/rows*9/8)) + 64
+	return max(n, min(full, 2*n))
+
+def append_rows(f, data_offset, var, x, rows):
+	# Append x to the last chunk of a variable stored in raw chunks along the
+	# first dimension, which has rows rows after the append. The chunk is
+	# extended in its space, which is enlarged if the chunk is at the end of
+	# the file, or relocated to the end of the file.
+	i = len(var['.chunk_offsets']) - 1
+	offsets = var['.chunk_offsets']
+	lens = var['.chunk_lens']
+	spaces = var.setdefault('.chunk_spaces', list(lens))
+	bufs = list(encode_compress_block(x, var))
+	n = sum([memoryview(buf).nbytes for buf in bufs])
+	f.seek(0, 2)
+	end = f.tell()
+	if lens[i] + n <= spaces[i]:
+		f.seek(data_offset + offsets[i] + lens[i])
+	elif data_offset + offsets[i] + spaces[i] >= end:
+		# The chunk is at the end of the file and its space is extended.
+		spaces[i] = append_space(lens[i] + n, rows, var['.chunks'][0])
+		f.truncate(data_offset + offsets[i] + spaces[i])
+		f.seek(data_offset + offsets[i] + lens[i])
+	else:
+		f.seek(data_offset + offsets[i])
+		buf = f.read(lens[i])
+		offsets[i] = end - data_offset
+		spaces[i] = append_space(lens[i] + n, rows, var['.chunks'][0])
+		f.truncate(data_offset + offsets[i] + spaces[i])
+		f.seek(data_offset + offsets[i])
+		f.write(buf)
+	for buf in bufs:
+		f.write(buf)
+	lens[i] += n
+	if all([k in var for k in CHUNK_STATS]):
+		stats = merge_chunk_stats([var[k][i] for k in CHUNK_STATS],
+			chunk_stats(x))
+		for k, y in zip(CHUNK_STATS, stats):
+			var[k][i] = y
+
+def shift_body(f, pos, delta):
+	# Shift the file content after pos by delta bytes forward.
+	f.seek(0, 2)
+	end = f.tell()
+	while end > pos:
+		n = min(end - pos, CHUNK_SIZE)
+		f.seek(end - n)
+		buf = f.read(n)
+		f.seek(end - n + delta)
+		f.write(buf)
+		end -= n
+
+def append(filename, d, dim):
+	ds.validate(d)
+	n = ds.dim(d, dim)
+	with open(filename, 'r+b') as f:
+		meta, data_offset = read_header(f)
+		f.seek(0)
+		header_len = data_offset - len(f.readline()) - 1
 		for name in ds.vars(d):
 			if ds.escape(name) not in meta:
+				raise ValueError('%s: variable not found in "%s"' % (
+					name, filename))
+		for name_e, var in meta.items():
+			if name_e.startswith('.'):
 				continue
-			var = meta[ds.escape(name)]
-			data = ds.var(d, name)
-			if data is None:
+			name = ds.unescape(name_e)
+			dims = var.get('.dims', [])
+			if dim not in dims:
 				continue
-			data = data.flatten()
-			if var['.missing'] is True:
-				mask = np.packbits(data.mask)
-				mask.tofile(f)
-			data2 = np.array(data) if not var['.missing'] else \
-				np.array(data)[~data.mask]
-			if var['.type'] in ['str', 'unicode']:
-				data3 = [
-					x.encode('utf-8') if type(x) in [str, np.str_] else x
-					for x in data2
+			k = dims.index(dim)
+			size = var['.size']
+			type_ = var['.type']
+			byteorder = {'l': '<', 'b': '>'}[var.get('.endian', 'b')]
+			dt = misc.type_to_dtype(type_)
+			if type_ not in ('bool', 'str', 'unicode'):
+				dt = dt.newbyteorder(byteorder)
+			new_size = list(size)
+			new_size[k] += n
+			if name in ds.vars(d):
+				x = ds.var(d, name)
+				if ds.dims(d, name) != dims or \
+				   any([x.shape[i] != size[i]
+				   for i in range(len(size)) if i != k]):
+					raise ValueError('%s: incompatible dimensions' % name)
+				if type_ not in ('str', 'unicode'):
+					x = x.astype(dt)
+			else:
+				shape = list(size)
+				shape[k] = n
+				x = np.ma.array(np.zeros(shape, dt), mask=True)
+			missing = bool(np.ma.is_masked(x))
+			rewrite = '.chunks' not in var or \
+				missing and not var.get('.missing', False)
+			# Raw chunks split only along the first dimension are extended
+			# without reading them.
+			raw = not rewrite and k == 0 and not var['.missing'] and \
+				type_ not in ('bool', 'str', 'unicode') and \
+				'.compression' not in var and \
+				list(var['.chunks'][1:]) == list(size[1:])
+			if rewrite:
+				# The whole variable is rewritten in the chunked layout.
+				start = 0
+			elif raw:
+				c = var['.chunks'][k]
+				start = -(-size[k]//c)*c
+				m = min(start - size[k], n)
+				if m > 0:
+					append_rows(f, data_offset, var, x[:m],
+						size[k] + m - start + c)
+					x = x[m:]
+			else:
+				start = size[k]//var['.chunks'][k]*var['.chunks'][k]
+			if not raw:
+				s = [slice(None)]*len(size)
+				s[k] = slice(start, size[k])
+				x0 = read_var(f, None, data_offset, var, tuple(s))
+				if x0 is None:
+					shape = list(size)
+					shape[k] = size[k] - start
+					x0 = np.zeros(shape, dt)
+				concatenate = np.ma.concatenate \
+					if isinstance(x0, np.ma.MaskedArray) or \
+					isinstance(x, np.ma.MaskedArray) \
+					else np.concatenate
+				x = concatenate([x0, x], axis=k)
+			if rewrite:
+				var['.missing'] = bool(var.get('.missing', False) or missing)
+				var['.size'] = new_size
+				var['.chunks'] = append_chunks(var, k)
+				grid = [0]*len(size)
+				offsets, lens, spaces = [], [], []
+			else:
+				grid = [int(np.ceil(m/c)) for m, c in zip(size, var['.chunks'])]
+				offsets, lens = var['.chunk_offsets'], var['.chunk_lens']
+				spaces = var.get('.chunk_spaces', lens)
+			chunks = var['.chunks']
+			stats = {k: var.pop(k) for k in CHUNK_STATS if k in var}
+			# Chunk statistics are only kept if available for all chunks.
+			with_stats = type_ not in ('bool', 'str', 'unicode') and \
+				(rewrite or len(stats) == len(CHUNK_STATS))
+			var['.size'] = new_size
+			var['.chunk_offsets'] = []
+			var['.chunk_lens'] = []
+			var['.chunk_spaces'] = []
+			new_grid = [int(np.ceil(m/c)) for m, c in zip(new_size, chunks)]
+			for jj in np.ndindex(*new_grid):
+				old = all([j < g for j, g in zip(jj, grid)])
+				i = np.ravel_multi_index(jj, grid) if old else None
+				if old and (jj[k] + 1)*chunks[k] <= start:
+					if with_stats:
+						set_chunk_stats(var, len(var['.chunk_offsets']),
+							[stats[k][i] for k in CHUNK_STATS])
+					var['.chunk_offsets'] += [offsets[i]]
+					var['.chunk_lens'] += [lens[i]]
+					var['.chunk_spaces'] += [spaces[i]]
+					continue
+				s = tuple([
+					slice(j*c - (start if i1 == k else 0),
+						min((j + 1)*c, m) - (start if i1 == k else 0))
+					for i1, (j, c, m) in enumerate(zip(jj, chunks, new_size))
+				])
+				if with_stats:
+					set_chunk_stats(var, len(var['.chunk_offsets']),
+						chunk_stats(x[s]))
+				bufs = list(encode_compress_block(x[s], var))
+				n1 = sum([memoryview(buf).nbytes for buf in bufs])
+				f.seek(0, 2)
+				end = f.tell()
+				if old and n1 <= spaces[i]:
+					# The chunk fits in the space of its previous version.
+					offset, space = offsets[i], spaces[i]
+				else:
+					# The space of a previous version at the end of the file
+					# is extended. The rest of the space is filled with zeros.
+					offset = offsets[i] \
+						if old and data_offset + offsets[i] + spaces[i] >= end \
+						else end - data_offset
+					space = append_space(n1, new_size[k] - jj[k]*chunks[k],
+						chunks[k])
+					f.truncate(data_offset + offset + space)
+				f.seek(data_offset + offset)
+				for buf in bufs:
+					f.write(buf)
+				var['.chunk_offsets'] += [offset]
+				var['.chunk_lens'] += [n1]
+				var['.chunk_spaces'] += [space]
+			var['.offset'] = min(var['.chunk_offsets'])
+			var['.len'] = sum(var['.chunk_lens'])
+		meta_s = json.dumps(meta, cls=JSONEncoder).encode('utf-8')
+		if len(meta_s) > header_len:
+			# Relocate the body to make space for the header. The space is
+			# doubled to make the cost of relocation amortized over appends.
+			delta = max(header_len, len(meta_s) - header_len)
+			shift_body(f, data_offset, delta)
+			header_len += delta
+		f.seek(0)
+		f.write(b'ds-%b\n' % VERSION.encode('utf-8'))
+		f.write(meta_s.ljust(header_len) + b'\n')
+
+def move_block(f, src, dst, n):
+	# Move n bytes in the file from src to a lower position dst.
+	while n > 0:
+		m = min(n, CHUNK_SIZE)
+		f.seek(src)
+		buf = f.read(m)
+		f.seek(dst)
+		f.write(buf)
+		src += m
+		dst += m
+		n -= m
+
+class Writer:
+	# A file created by create, whose variables are written by parts with
+	# write_slice. The parts of a variable are buffered until they complete
+	# a row of chunks along the dimension they are written along, and the
+	# chunks are then written at the end of the file. The header is written
+	# on closing the file, in space reserved for its maximum length.
+	def __init__(self, filename, d, chunks, filters, codec):
+		self.chunks = chunks
+		self.meta = {}
+		self.state = {}
+		# Number of bytes of blocks which were rewritten elsewhere.
+		self.unused = 0
+		for name in ds.vars(d, full=True):
+			var = copy(ds.meta(d, name))
+			for k in CHUNK_META + ['.offset', '.len', '.endian']:
+				var.pop(k, None)
+			type_ = var.setdefault('.type', 'float64')
+			if misc.type_to_dtype(type_) is None or var.get('.size') is None:
+				continue
+			var['.size'] = list(var['.size'])
+			var['.offset'] = 0
+			var['.len'] = 0
+			# Variables are stored with a mask if the metadata say so, or
+			# from the first part with missing values.
+			var['.missing'] = bool(var.get('.missing', False))
+			if type_ != 'bool':
+				var['.endian'] = sys.byteorder[0]
+			var_filters = filters \
+				if type_ not in ('bool', 'str', 'unicode') else []
+			if np.prod(var['.size']) > 0 and len(var['.size']) > 0 and \
+			   (codec != 'none' or len(var_filters) > 0):
+				var['.compression'] = var_filters + [codec]
+			self.meta[ds.escape(name)] = var
+		self.meta['.'] = ds.meta(d, '')
+		self.header_len = len(json.dumps(self.header_bound(),
+			cls=JSONEncoder))
+		self.f = open(filename, 'w+b')
+		self.f.write(b'ds-%b\n' % VERSION.encode('utf-8'))
+		self.f.write(b' '*self.header_len + b'\n')
+		self.body_pos = self.f.tell()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type_, value, traceback):
+		if type_ is None:
+			self.close()
+		else:
+			self.f.close()
+
+	def var_chunks(self, var, axis):
+		# Chunks of a variable written along axis. Unless set in chunks, the
+		# axis is split into chunks of about CHUNK_SIZE bytes.
+		size = var['.size']
+		chunks = append_chunks(var, axis)
+		if self.chunks is not None:
+			chunks = [
+				self.chunks.get(dim, c if i == axis else n)
+				for i, (dim, n, c) in enumerate(zip(var['.dims'], size, chunks))
+			]
+		return [max(min(c, n), 1) for c, n in zip(chunks, size)]
+
+	def header_bound(self):
+		# Metadata with the maximum length of the header.
+		meta = deepcopy(self.meta)
+		for var in meta.values():
+			size = var.get('.size')
+			if size is None or len(size) == 0 or np.prod(size) == 0:
+				continue
+			count = max([
+				int(np.prod([
+					-(-n//c) for n, c in zip(size, self.var_chunks(var, k))
+				]))
+				for k in range(len(size))
+			])
+			var['.offset'] = var['.len'] = 2**53
+			var['.chunks'] = [2**53]*len(size)
+			var['.chunk_offsets'] = var['.chunk_lens'] = [2**53]*count
+			if var['.type'] not in ('bool', 'str', 'unicode'):
+				for k in CHUNK_STATS:
+					var[k] = [-np.finfo('float64').max]*count
+		return meta
+
+	def write_block(self, var, i, data):
+		# Write a variable or its chunk i at the end of the file.
+		if np.ma.is_masked(data) and not var['.missing']:
+			self.set_missing(var)
+		self.f.seek(0, 2)
+		offset = self.f.tell() - self.body_pos
+		n = write_block(self.f, data, var)
+		if i is None:
+			var['.offset'] = offset
+			var['.len'] = n
+			return
+		var['.chunk_offsets'][i] = offset
+		var['.chunk_lens'][i] = n
+		if var['.type'] not in ('bool', 'str', 'unicode'):
+			for k, x in zip(CHUNK_STATS, chunk_stats(data)):
+				var[k][i] = x
+
+	def set_missing(self, var):
+		# Store a variable with a mask. Chunks already written are rewritten.
+		old = deepcopy(var)
+		var['.missing'] = True
+		if '.chunks' not in var:
+			return
+		self.f.flush()
+		for i, s in enumerate(iter_chunks(var['.size'], var['.chunks'])):
+			if old['.chunk_offsets'][i] is None:
+				continue
+			data = read_chunked(self.f, None, self.body_pos, old, s)
+			self.unused += old['.chunk_lens'][i]
+			self.write_block(var, i, data)
+
+	def write_slice(self, name, s, data):
+		var = self.meta[ds.escape(name)]
+		size = var['.size']
+		type_ = var['.type']
+		if not isinstance(data, np.ma.MaskedArray):
+			data = np.asarray(data)
+		if type_ not in ('str', 'unicode'):
+			data = data.astype(misc.type_to_dtype(type_))
+		if len(size) == 0 or np.prod(size) == 0:
+			if len(size) == 0:
+				self.write_block(var, None, data)
+			return
+		st = self.state.get(name)
+		if st is None:
+			axis = ([
+				i for i, s1 in enumerate(s)
+				if s1.indices(size[i]) != (0, size[i], 1)
+			] + [0])[0]
+			chunks = self.var_chunks(var, axis)
+			if chunks != size or '.compression' in var:
+				var['.chunks'] = chunks
+				count = int(np.prod([-(-n//c) for n, c in zip(size, chunks)]))
+				var['.chunk_offsets'] = [None]*count
+				var['.chunk_lens'] = [None]*count
+				if type_ not in ('bool', 'str', 'unicode'):
+					for k in CHUNK_STATS:
+						var[k] = [None]*count
+			st = SimpleNamespace(axis=axis, pos=0, start=0, parts=[])
+			self.state[name] = st
+		axis = st.axis
+		for i, s1 in enumerate(s):
+			start, stop, step = s1.indices(size[i])
+			if i == axis and (start != st.pos or step != 1) or \
+			   i != axis and (start, stop, step) != (0, size[i], 1):
+				raise ValueError('%s: parts must be written in order along one dimension' % name)
+			if i == axis:
+				st.pos = stop
+		st.parts += [data]
+		c = var['.chunks'][axis] if '.chunks' in var else size[axis]
+		if st.pos - st.start < c and st.pos < size[axis]:
+			return
+		concatenate = np.ma.concatenate \
+			if any([isinstance(x, np.ma.MaskedArray) for x in st.parts]) \
+			else np.concatenate
+		x = concatenate(st.parts, axis=axis) if len(st.parts) > 1 \
+			else st.parts[0]
+		m = x.shape[axis] if st.pos == size[axis] else x.shape[axis]//c*c
+		if '.chunks' not in var:
+			self.write_block(var, None, x)
+		else:
+			grid = [-(-n//c1) for n, c1 in zip(size, var['.chunks'])]
+			for j in range(0, m, c):
+				grid1 = list(grid)
+				grid1[axis] = 1
+				for jj in np.ndindex(*grid1):
+					s2 = tuple([
+						slice(j, j + c) if i == axis else
+						slice(j1*c1, (j1 + 1)*c1)
+						for i, (j1, c1) in enumerate(zip(jj, var['.chunks']))
+					])
+					jj = list(jj)
+					jj[axis] = (st.start + j)//c
+					i = int(np.ravel_multi_index(jj, grid))
+					self.write_block(var, i, x[s2])
+		st.start += m
+		s3 = [slice(None)]*len(size)
+		s3[axis] = slice(m, None)
+		st.parts = [x[tuple(s3)]] if m < x.shape[axis] else []
+
+	def compact(self):
+		# Move blocks down to the space of blocks which were rewritten.
+		blocks = []
+		for name, var in self.meta.items():
+			if name == '.':
+				continue
+			if '.chunks' in var:
+				blocks += [
+					(offset, n, var, i) for i, (offset, n) in
+					enumerate(zip(var['.chunk_offsets'], var['.chunk_lens']))
 				]
-				slen = np.array([len(x) for x in data3], np.uint64)
-				slen.tofile(f)
-				for x in data3:
-					f.write(x)
+			elif var['.len'] > 0:
+				blocks += [(var['.offset'], var['.len'], var, None)]
+		pos = 0
+		for offset, n, var, i in sorted(blocks, key=lambda x: x[0]):
+			if offset != pos:
+				move_block(self.f, self.body_pos + offset,
+					self.body_pos + pos, n)
+			if i is None:
+				var['.offset'] = pos
 			else:
-				if var['.type'] == 'bool':
-					data2 = np.packbits(data2)
-				data2.tofile(f)
+				var['.chunk_offsets'][i] = pos
+			pos += n
+		self.f.truncate(self.body_pos + pos)
+
+	def close(self):
+		f = self.f
+		version = '1.0'
+		for name, var in self.meta.items():
+			if name == '.' or '.chunks' not in var:
+				continue
+			if None in var['.chunk_offsets']:
+				f.close()
+				raise ValueError('%s: variable not written completely' % \
+					ds.unescape(name))
+			version = VERSION
+		if self.unused > 0:
+			self.compact()
+		for name, var in self.meta.items():
+			if name != '.' and '.chunks' in var:
+				var['.offset'] = min(var['.chunk_offsets'])
+				var['.len'] = sum(var['.chunk_lens'])
+		meta_s = json.dumps(self.meta, cls=JSONEncoder).encode('utf-8')
+		header_len = self.header_len
+		if len(meta_s) > header_len:
+			delta = len(meta_s) - header_len
+			shift_body(f, self.body_pos, delta)
+			header_len += delta
+		f.seek(0)
+		f.write(b'ds-%b\n' % version.encode('utf-8'))
+		f.write(meta_s.ljust(header_len) + b'\n')
+		f.close()
+
+def create(filename, d, chunks=None, compression=None, threads=None):
+	# Create a file with variables defined by the metadata of d, whose data
+	# are written by parts with write_slice. The parts of a variable must be
+	# written in order along one dimension. Chunks are written sequentially,
+	# and threads is accepted for compatibility with write.
+	misc.check(threads, 'threads', [int, None])
+	misc.check(chunks, 'chunks', [[dict, str, int], None])
+	misc.check(compression, 'compression', [str, [list, str], None])
+	filters, codec = parse_compression(compression)
+	return Writer(filename, d, chunks, filters, codec)
+
+def write_slice(f, var, s, data):
+	f.write_slice(var, s, data)
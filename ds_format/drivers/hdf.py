@@ -4,6 +4,11 @@ from ds_format import misc
 
 READ_EXT = ['h5', 'hdf5', 'he5', 'hdf']
 WRITE_EXT = ['h5', 'hdf5', 'he5', 'hdf']
+READ_OPTS = []
+WRITE_OPTS = ['calendar', 'time_units']
+# Files are read with the HDF5 library, which is not thread-safe. Reading
+# is serialized with other drivers which use it.
+THREAD_SAFE = False
 
 def detect(filename):
 	import h5py
@@ -19,6 +24,42 @@ def read_attrs(v, name=''):
 		for k, v in v.attrs.items()
 	}
 
+def read_sel(v, s):
+	# h5py supports indexing by an array only if it is increasing and on one
+	# dimension, and by a slice only with a positive step. The first array is
+	# read as unique sorted indexes, a slice with a negative step as the
+	# same items in increasing order, and the rest of the selection is
+	# applied after reading.
+	s1 = []
+	s2 = []
+	for x, n in zip(s, v.shape):
+		if isinstance(x, slice) and x.step is not None and x.step < 0:
+			r = range(*x.indices(n))
+			if len(r) == 0:
+				s1 += [slice(0, 0)]
+				s2 += [slice(None)]
+			else:
+				s1 += [slice(r[-1], r[0] + 1, -r.step)]
+				s2 += [slice(None, None, -1)]
+			continue
+		if isinstance(x, (np.ndarray, list, tuple)):
+			x = np.asarray(x)
+			x = np.nonzero(x)[0] if x.dtype == np.bool_ \
+				else x.astype(int, copy=False)
+			if all([not isinstance(y, np.ndarray) for y in s1]) and \
+			   len(x) > 0:
+				x, x2 = np.unique(x, return_inverse=True)
+				s1 += [x]
+				s2 += [x2]
+			else:
+				s1 += [slice(None)]
+				s2 += [x]
+		else:
+			s1 += [x]
+			if isinstance(x, slice):
+				s2 += [slice(None)]
+	return misc.sel_apply(v[tuple(s1)], s2)
+
 def read_var(f, var, name, sel=None, data=True):
 	import h5py
 	v = f[name]
@@ -35,7 +76,7 @@ def read_var(f, var, name, sel=None, data=True):
 	if data:
 		if sel:
 			s = ds.misc.sel_slice(sel, dims)
-			x = v[s]
+			x = read_sel(v, s)
 			dims = ds.misc.sel_dims(sel, dims)
 		else:
 			x = v[()] if v.ndim == 0 else v[::]
@@ -77,15 +118,21 @@ def read_group(f, variables, sel, full):
 				ds.meta(d, var, var_meta)
 	return d
 
-def read(filename, variables=None, sel=None, full=False, jd=False):
+def open_(filename):
 	import h5py
-	with h5py.File(filename, 'r') as f:
-		d = read_group(f, variables, sel, full)
+	return h5py.File(filename, 'r')
+
+def read_handle(f, variables=None, sel=None, full=False, jd=False):
+	d = read_group(f, variables, sel, full)
 	if jd:
 		for var in ds.vars(d):
 			misc.process_cf_time_var(d, var)
 	return d
 
+def read(filename, variables=None, sel=None, full=False, jd=False):
+	with open_(filename) as f:
+		return read_handle(f, variables, sel, full, jd)
+
 def write(filename, d, time_units=None, calendar=None):
 	import h5py
 	ds.validate(d)
@@ -124,3 +171,37 @@ def write(filename, d, time_units=None, calendar=None):
 				f[group].attrs[attr] = v
 			else:
 				f.attrs[k] = v
+
+def create(filename, d):
+	# Create a file with variables defined by the metadata of d, whose data
+	# are written by parts with write_slice.
+	import h5py
+	f = h5py.File(filename, 'w')
+	for var in ds.vars(d, full=True):
+		type_ = ds.type(d, var)
+		dtype = h5py.string_dtype() if type_ in ('str', 'unicode') \
+			else misc.type_to_dtype(type_)
+		f.create_dataset(var, ds.size(d, var), dtype)
+		for i, dim in enumerate(ds.dims(d, var, full=True)):
+			f[var].dims[i].label = dim
+		for k, v in ds.attrs(d, var).items():
+			f[var].attrs[k] = v
+	for k, v in ds.attrs(d).items():
+		path = k.split('/')
+		if len(path) > 1:
+			group = '/'.join(path[:-1])
+			attr = path[-1]
+			f[group].attrs[attr] = v
+		else:
+			f.attrs[k] = v
+	return f
+
+def write_slice(f, var, s, data):
+	if data.dtype.kind in ('U', 'O'):
+		data = np.ma.filled(data, '')
+		data2 = [
+			x.encode('utf-8') if isinstance(x, str) else x
+			for x in data.flatten()
+		]
+		data = np.array(data2).reshape(data.shape)
+	f[var][s] = np.ma.getdata(data)
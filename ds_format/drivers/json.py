@@ -3,6 +3,11 @@ import ds_format as ds
 
 READ_EXT = ['json']
 WRITE_EXT = ['json']
+READ_OPTS = []
+WRITE_OPTS = []
+# The whole file is parsed to read any part of it, so variables are not read
+# lazily.
+LAZY = False
 
 def read(filename, variables=None, sel=None, full=False, jd=False):
 	import json
@@ -5,6 +5,11 @@ from ds_format import misc
 
 READ_EXT = ['nc', 'nc4', 'nc3', 'netcdf']
 WRITE_EXT = ['nc', 'nc4', 'netcdf']
+READ_OPTS = []
+WRITE_OPTS = ['calendar', 'time_units']
+# Files are read with the HDF5 library, which is not thread-safe. Reading
+# is serialized with other drivers which use it.
+THREAD_SAFE = False
 
 JD_UNITS = 'days since -4713-11-24 12:00 UTC'
 JD_CALENDAR = 'proleptic_gregorian'
@@ -51,27 +56,33 @@ def read_var(f, name, sel=None, data=True):
 	})
 	return [x, attrs]
 
-def read(filename, variables=None, sel=None, full=False, jd=False):
+def open_(filename):
 	from netCDF4 import Dataset
 	if isinstance(filename, bytes):
 		filename = os.fsdecode(filename)
-	with Dataset(filename, 'r') as f:
-		d = {}
-		ds.attrs(d, None, read_attrs(f))
-		for var in f.variables.keys():
-			if variables is not None and var not in variables:
-				if full:
-					_, var_meta = read_var(f, var, sel, False)
-					ds.meta(d, var, var_meta)
-			else:
-				data, var_meta = read_var(f, var, sel)
-				ds.var(d, var, data)
+	return Dataset(filename, 'r')
+
+def read_handle(f, variables=None, sel=None, full=False, jd=False):
+	d = {}
+	ds.attrs(d, None, read_attrs(f))
+	for var in f.variables.keys():
+		if variables is not None and var not in variables:
+			if full:
+				_, var_meta = read_var(f, var, sel, False)
 				ds.meta(d, var, var_meta)
+		else:
+			data, var_meta = read_var(f, var, sel)
+			ds.var(d, var, data)
+			ds.meta(d, var, var_meta)
 	if jd:
 		for var in ds.vars(d):
 			misc.process_cf_time_var(d, var)
 	return d
 
+def read(filename, variables=None, sel=None, full=False, jd=False):
+	with open_(filename) as f:
+		return read_handle(f, variables, sel, full, jd)
+
 def write(filename, d,
 	time_units='days since -4713-11-24 12:00 UTC',
 	calendar='proleptic_gregorian',
@@ -112,5 +123,31 @@ def write(filename, d,
 				v[::] = data
 		f.setncatts(ds.attrs(d))
 
+def create(filename, d):
+	# Create a file with variables defined by the metadata of d, whose data
+	# are written by parts with write_slice.
+	from netCDF4 import Dataset
+	if isinstance(filename, bytes):
+		filename = os.fsdecode(filename)
+	f = Dataset(filename, 'w')
+	for k, v in ds.dims(d, full=True, size=True).items():
+		f.createDimension(k, v)
+	for var in ds.vars(d, full=True):
+		type_ = ds.type(d, var)
+		dtype = str if type_ in ('str', 'unicode') \
+			else misc.type_to_dtype(type_)
+		v = f.createVariable(var, dtype, ds.dims(d, var, full=True))
+		v.setncatts(ds.attrs(d, var))
+	f.setncatts(ds.attrs(d))
+	return f
+
+def write_slice(f, var, s, data):
+	if data.dtype == 'O':
+		data = np.ma.filled(data, '')
+		data[data == None] = ''
+	elif isinstance(data, np.ma.MaskedArray) and data.dtype.kind in ['S', 'U']:
+		data = data.filled('')
+	f[var][s] = data
+
 from_netcdf = read
 to_netcdf = write
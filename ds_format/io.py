@@ -1,29 +1,157 @@
 import os
 import glob
+import collections
+import tempfile
+import threading
 import traceback as tb
 from .drivers import DRIVERS
 import ds_format as ds
 from ds_format.misc import check
+from ds_format.lazy import LazyArray
 import numpy as np
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-def index(dirname, variables=None, warnings=[], **kwargs):
+# Directory for temporary files with arrays transferred from readdir worker
+# processes. A memory-backed file system is used if available.
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Minimum size in bytes of arrays transferred in temporary files.
+SHM_MIN_SIZE = 65536
+
+# Lock held while reading with drivers which are not thread-safe (NetCDF and
+# HDF5, which both use the HDF5 library). Other drivers are not locked.
+READ_LOCK = threading.RLock()
+
+def index(dirname, variables=None, warnings=[], catalog=False, **kwargs):
 	l = sorted(os.listdir(dirname))
 	dd = []
-	for name in l:
-		filename = os.path.join(dirname, name)
-		try: d = ds.read(filename, variables=variables, **kwargs)
-		except Exception as e:
-			warnings.append((
-				'%s: %s' % (filename, e),
-				tb.format_exc()
-			))
-			continue
-		ds.var(d, 'filename', filename)
-		ds.dims(d, 'filename', [])
-		dd.append(d)
+	c = ds.catalog.open_(catalog, dirname)
+	try:
+		for name in l:
+			filename = os.path.join(dirname, name)
+			try:
+				if c is None:
+					d = ds.read(filename, variables=variables, **kwargs)
+				else:
+					d = read_catalog(c, filename, variables, kwargs)
+			except Exception as e:
+				warnings.append((
+					'%s: %s' % (filename, e),
+					tb.format_exc()
+				))
+				continue
+			if d is None:
+				continue
+			ds.var(d, 'filename', filename)
+			ds.dims(d, 'filename', [])
+			dd.append(d)
+	finally:
+		if c is not None: c.close()
 	return dd
 
+def read_catalog(c, filename, variables, kwargs):
+	# Read a file with the help of catalog c, and update the catalog entry of
+	# the file if needed.
+	if not os.path.exists(filename):
+		raise IOError('%s: File does not exist' % filename)
+	st = os.stat(filename)
+	d, entry, changed = ds.catalog.read(filename, variables, kwargs,
+		c.get(filename, st))
+	if changed:
+		c.put(filename, st, entry)
+	return d
+
+def read_lazy(read1, filename, variables, sel, full, jd, opts):
+	d = read1([], None, True, False)
+	for var in ds.vars(d, full=True):
+		var_e = ds.escape(var)
+		if variables is not None and var not in variables:
+			d.pop(var_e, None)
+			if not full:
+				del d['.'][var_e]
+			continue
+		meta = ds.meta(d, var)
+		# Drivers which do not store the size in the metadata read the data
+		# regardless.
+		if var_e in d or meta.get('.size') is None:
+			continue
+		d[var_e] = LazyArray(filename, var, ds.dims(d, var), meta['.size'],
+			meta.get('.type'), opts=opts, jd=jd)
+	if sel is not None:
+		ds.select(d, sel)
+	return d
+
+def resolve_sel(read1, sel, range_, at, between):
+	# Resolve the selectors to a selector of dimension indexes. Returns the
+	# selector and a dataset with the selector variables read whole.
+	sel_vars = []
+	if at is not None:
+		sel_vars += list(at.keys())
+	if between is not None:
+		sel_vars += list(between.keys())
+	d_tmp = None
+	pre = {}
+	if len(sel_vars) > 0 or range_ is not None:
+		d_tmp = read1([], None, True, False)
+		# Only the parts of the selector variables which can match based on
+		# chunk statistics are read.
+		pre = ds.misc.sel_prune(d_tmp, at, between)
+		for var, ii in pre.items():
+			dim = ds.dims(d_tmp, var)[0]
+			d_var = read1([var], {dim: ii}, False, False)
+			pre[var] = (ii, ds.var(d_var, var))
+		sel_vars = [var for var in sel_vars if var not in pre]
+		if len(sel_vars) > 0:
+			d_tmp = read1(sel_vars, None, True, False)
+	sel = ds.misc.sel_from_any(d_tmp, sel, range_, at, between, pre)
+	return sel, (d_tmp if len(sel_vars) > 0 else None)
+
+def read_sel(read1, variables, sel, d_tmp, full, jd):
+	# Read selected data with read1. Variables already read whole in d_tmp
+	# are subset in memory instead of being read again.
+	reuse = [] if d_tmp is None else [
+		var for var in ds.vars(d_tmp)
+		if variables is None or var in variables
+	]
+	if len(reuse) == 0:
+		return read1(variables, sel, full, jd)
+	if variables is None:
+		variables = ds.vars(d_tmp, full=True)
+	d = read1([var for var in variables if var not in reuse], sel, full, jd)
+	d_reuse = {'.': {}}
+	for var in reuse:
+		ds.var(d_reuse, var, ds.var(d_tmp, var))
+		ds.meta(d_reuse, var, ds.meta(d_tmp, var))
+	ds.select(d_reuse, sel)
+	for var in reuse:
+		ds.var(d, var, ds.var(d_reuse, var))
+		ds.meta(d, var, ds.meta(d_reuse, var))
+		if jd:
+			ds.misc.process_cf_time_var(d, var)
+	return d
+
+def read_open(read1, filename, variables, sel, range_, at, between, full, jd,
+	lazy, opts, selective):
+	d_tmp = None
+	if selective:
+		sel, d_tmp = resolve_sel(read1, sel, range_, at, between)
+	if lazy:
+		return read_lazy(read1, filename, variables, sel, full, jd, opts)
+	return read_sel(read1, variables, sel, d_tmp, full, jd)
+
+def read_driver(driver, filename, variables, sel, range_, at, between, full,
+	jd, lazy, opts, selective):
+	lazy = lazy and getattr(driver, 'LAZY', True)
+	# Drivers which support it read from a file opened once.
+	if hasattr(driver, 'open_'):
+		with driver.open_(filename, **opts) as f:
+			read1 = lambda *args: driver.read_handle(f, *args)
+			return read_open(read1, filename, variables, sel, range_, at,
+				between, full, jd, lazy, opts, selective)
+	read1 = lambda *args: driver.read(filename, *args, **opts)
+	return read_open(read1, filename, variables, sel, range_, at, between,
+		full, jd, lazy, opts, selective)
+
 def read(filename,
     variables=None,
     sel=None,
@@ -32,11 +160,15 @@ def read(filename,
     between=None,
     full=False,
     jd=False,
+    mmap=False,
+    fixed_str=False,
+    threads=None,
+    lazy=False,
 ):
 	'''
 	title: read
 	caption: "Read dataset from a file."
-	usage: "`read`(*filename*, *variables*=`None`, *sel*=`None`, *range_*=`None`, *at*=`None`, *between*=`None`, *full*=`False`, *jd*=`False`)"
+	usage: "`read`(*filename*, *variables*=`None`, *sel*=`None`, *range_*=`None`, *at*=`None`, *between*=`None`, *full*=`False`, *jd*=`False`, *mmap*=`False`, *fixed_str*=`False`, *threads*=`None`, *lazy*=`False`)"
 	arguments: {{
 		*filename*: "Filename (`str`, `bytes` or `os.PathLike`)."
 		*variables*: "Variable names to read (`str` or `list` of `str`) or `None` to read all variables."
@@ -48,6 +180,10 @@ def read(filename,
 		*between*: "Select based on a range between two variable values (see **[select](#select)**)."
 		*full*: "Read all metadata (`bool`)."
 		*jd*: "Convert time variables to Julian dates (see [Aquarius Time](https://github.com/peterkuma/aquarius-time)) (`bool`)."
+		*mmap*: "Memory-map the file instead of reading it into memory (`bool`). Numeric variables without missing values are returned as read-only `np.memmap` arrays, and only the parts of the file which are accessed are read from the disk. Other variables are decoded from the memory map. DS only."
+		*fixed_str*: "Return string variables as fixed-width `np.bytes_` or `np.str_` arrays instead of arrays of objects (`bool`). DS only."
+		*threads*: "Number of threads to read variables with in parallel (`int`) or `None` to read variables sequentially. DS only."
+		*lazy*: "Read variable data lazily (`bool`). If `true`, variable data are proxy objects which are read from the file on first access with **[var](#var)** or on conversion to a NumPy array. Subsetting with **[select](#select)** is applied when the data are read, so that only the selected data are read from the file. Conversion of time variables to Julian dates with *jd* is applied on access with **[var](#var)**. CSV and JSON files are read whole regardless."
 	}}
 	"Supported formats": {{
 		CSV/TSV: "`.csv`, `.tsv`, `.tab`"
@@ -86,25 +222,21 @@ $ print(d['.'])
 	check(range_, 'range_', [[dict, str], None])
 	check(at, 'at', [[dict, str], None])
 	check(between, 'between', [[dict, str], None])
+	check(mmap, 'mmap', bool)
+	check(fixed_str, 'fixed_str', bool)
+	check(threads, 'threads', [int, None])
+	check(lazy, 'lazy', bool)
 
 	if isinstance(filename, os.PathLike): filename = filename.__fspath__()
 	if not os.path.exists(filename):
 		raise IOError('%s: File does not exist' % filename)
 
-	if sel is not None or \
+	if isinstance(variables, str):
+		variables = [variables]
+	selective = sel is not None or \
 		range_ is not None or \
 		at is not None or \
-		between is not None:
-
-		sel_vars = []
-		if range_ is not None:
-			sel_vars += list(range_.keys())
-		if at is not None:
-			sel_vars += list(at.keys())
-		if between is not None:
-			sel_vars += list(between.keys())
-		d_tmp = read(filename, sel_vars) if len(sel_vars) > 0 else None
-		sel = ds.misc.sel_from_any(d_tmp, sel, range_, at, between)
+		between is not None
 
 	for name, driver in DRIVERS.items():
 		for ext in driver.READ_EXT:
@@ -112,33 +244,129 @@ $ print(d['.'])
 			if isinstance(filename, bytes):
 				end = end.encode('utf-8')
 			if filename.endswith(end):
-				d = driver.read(filename, variables, sel, full, jd)
-				return d
+				opts = {
+					k: v for k, v in {
+						'mmap': mmap,
+						'fixed_str': fixed_str,
+						'threads': threads,
+					}.items()
+					if k in driver.READ_OPTS
+				}
+				if not getattr(driver, 'THREAD_SAFE', True):
+					with READ_LOCK:
+						return read_driver(driver, filename, variables, sel,
+							range_, at, between, full, jd, lazy, opts,
+							selective)
+				return read_driver(driver, filename, variables, sel, range_,
+					at, between, full, jd, lazy, opts, selective)
 
 	raise IOError('%s: Unknown file format' % filename)
 
+# Array transferred from a worker process in a temporary file, which is
+# memory-mapped by the main process. Masked arrays have the mask stored as
+# another array.
+class SharedArray(object):
+	def __init__(self, filename, dtype, shape, mask=None):
+		self.filename = filename
+		self.dtype = dtype
+		self.shape = shape
+		self.mask = mask
+
+	@property
+	def nbytes(self):
+		return int(np.prod(self.shape))*np.dtype(self.dtype).itemsize
+
+def share_array(data):
+	if np.ma.isMaskedArray(data):
+		x = share_array(np.ma.getdata(data))
+		if isinstance(x, SharedArray):
+			x.mask = share_array(np.ma.getmask(data))
+			return x
+		return data
+	if not isinstance(data, np.ndarray) or data.dtype.kind not in 'biuf' or \
+	   data.nbytes < SHM_MIN_SIZE:
+		return data
+	fd, filename = tempfile.mkstemp(prefix='ds-', dir=SHM_DIR)
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			f.write(np.ascontiguousarray(data).data)
+	except OSError:
+		os.remove(filename)
+		return data
+	return SharedArray(filename, data.dtype, data.shape)
+
+def unshare_array(x):
+	if not isinstance(x, SharedArray):
+		return x
+	try:
+		data = np.asarray(np.memmap(x.filename, x.dtype, 'r+',
+			shape=x.shape))
+	finally:
+		# The mapping remains valid after the file is removed.
+		os.remove(x.filename)
+	if x.mask is not None:
+		return np.ma.array(data, mask=unshare_array(x.mask))
+	return data
+
+def share(d):
+	for var in ds.vars(d):
+		var_e = ds.escape(var)
+		d[var_e] = share_array(d[var_e])
+
+def unshare(d):
+	for var in ds.vars(d):
+		var_e = ds.escape(var)
+		d[var_e] = unshare_array(d[var_e])
+
 def readdir_worker(args):
-	filename, extensions, variables, kwargs = args
+	filename, extensions, variables, kwargs, entry, use_catalog, shm = args
 	warnings = []
 	if not os.path.isfile(filename) or not filename.endswith(extensions):
-		return None, warnings
-	try: d = ds.read(filename, variables=variables, **kwargs)
+		return None, warnings, None
+	try:
+		d, entry = readdir_read(filename, variables, kwargs, entry,
+			use_catalog)
 	except Exception as e:
 		warnings += [(
 			'%s: %s' % (filename, e),
 			tb.format_exc()
 		)]
-		return None, warnings
+		return None, warnings, None
+	if d is None:
+		return None, warnings, entry
 	ds.var(d, 'filename', filename)
 	ds.dims(d, 'filename', [])
-	return d, warnings
+	if shm:
+		share(d)
+	return d, warnings, entry
+
+def readdir_files(dirname, recursive):
+	pattern = '**' if recursive else '*'
+	files = sorted(glob.glob(os.path.join(glob.escape(dirname), pattern),
+		recursive=recursive))
+	extensions = tuple(['.' + ext
+		for driver in DRIVERS.values()
+		for ext in driver.READ_EXT
+	])
+	return files, extensions
+
+def file_size(filename):
+	try: return os.path.getsize(filename)
+	except OSError: return 0
+
+def readdir_read(filename, variables, kwargs, entry, use_catalog):
+	if use_catalog:
+		d, entry, changed = ds.catalog.read(filename, variables, kwargs, entry)
+		return d, (entry if changed else None)
+	return ds.read(filename, variables=variables, **kwargs), None
 
 def readdir(dirname, variables=None, merge=None, warnings=[], recursive=False,
-	parallel=False, executor=None, njobs=None, **kwargs):
+	parallel=False, executor=None, njobs=None, backend='process',
+	transfer='shm', catalog=False, **kwargs):
 	'''
 	title: readdir
 	caption: "Read all data files in a directory."
-	usage: "`readdir`(*dirname*, *variables*=`None`, *merge*=`None`, *warnings*=[], *recursive*=`False`, *parallel*=`False`, *executor*=`None`, *njobs*=`None`, ...)"
+	usage: "`readdir`(*dirname*, *variables*=`None`, *merge*=`None`, *warnings*=[], *recursive*=`False`, *parallel*=`False`, *executor*=`None`, *njobs*=`None`, *backend*=`'process'`, *transfer*=`'shm'`, *catalog*=`False`, ...)"
 	arguments: {{
 		*dirname*: "Directory name (`str`, `bytes` or `os.PathLike`)."
 	}}
@@ -151,6 +379,9 @@ def readdir(dirname, variables=None, merge=None, warnings=[], recursive=False,
 		*parallel*: "Enable parallel execution."
 		*executor*: "`concurrent.futures.Executor` instance or `None` to use a new executor."
 		*njobs*: "Number of parallel jobs or `None` to use the number of CPU cores."
+		*backend*: "Parallel execution backend (`str`): `process` to read files in worker processes or `thread` to read files in worker threads. The thread backend avoids the transfer of the results between processes, but only the DS driver reads files in parallel with it, because it releases the GIL while reading. Reading of NetCDF and HDF5 files is serialized."
+		*transfer*: "Method of transfer of the results from worker processes (`str`): `pickle` to send the results through a pipe or `shm` to pass numerical arrays in temporary files in shared memory (`/dev/shm` if available), which are memory-mapped without copying."
+		*catalog*: "Catalog of file metadata to use (`bool` or `str`). If `True`, use a catalog `.ds-catalog` in the directory *dirname*. If `str`, use a catalog in the file *catalog*. If `False`, do not use a catalog. The catalog is an SQLite database, which is created if it does not exist. It stores the metadata of files and the minimum and maximum of variables used in *between*, and is updated for files which are new or whose size or modification time changed. Metadata-only reads (*variables* is `[]` and *full* is `true`) are served from the catalog without opening the files, and files in which all values of a variable in *between* are outside of the range are skipped."
 		...: "Optional keyword arguments passed to **[read](#read)**."
 	}}
 	"Supported formats": {{
@@ -187,37 +418,79 @@ $ print(d['temperature'])
 	check(variables, 'variables', [str, [list, str], [tuple, str], None])
 	check(merge, 'merge', [str, None])
 	check(warnings, 'warnings', list)
+	check(backend, 'backend', str)
+	check(transfer, 'transfer', str)
+	check(catalog, 'catalog', [bool, str])
+	if backend not in ('process', 'thread'):
+		raise ValueError('invalid backend "%s"' % backend)
+	if transfer not in ('pickle', 'shm'):
+		raise ValueError('invalid transfer "%s"' % transfer)
 	if isinstance(dirname, os.PathLike): dirname = dirname.__fspath__()
 
-	pattern = '**' if recursive else '*'
-	files = sorted(glob.glob(os.path.join(glob.escape(dirname), pattern),
-		recursive=recursive))
-	dd = []
-	extensions = tuple(['.' + ext
-		for driver in DRIVERS.values()
-		for ext in driver.READ_EXT
-	])
-	mapfn = map
+	files, extensions = readdir_files(dirname, recursive)
+	c = ds.catalog.open_(catalog, dirname)
+	# Catalog entries are looked up and stored by the main process, and passed
+	# to and from the workers.
+	entries = [None]*len(files)
+	stats = [None]*len(files)
+	if c is not None:
+		for i, filename in enumerate(files):
+			if os.path.isfile(filename):
+				stats[i] = os.stat(filename)
+				entries[i] = c.get(filename, stats[i])
+	args = [
+		(filename, extensions, variables, kwargs, entry, c is not None)
+		for filename, entry in zip(files, entries)
+	]
 	ex = None
+	own = False
+	shm = False
+	res = []
+	n = 0
+	dd = []
 	try:
 		if parallel:
 			if njobs is None: njobs = os.cpu_count()
-			ex = ProcessPoolExecutor(njobs) if executor is None else executor
-			mapfn = ex.map
-		if ex is not None: ex.__enter__()
-		res = mapfn(readdir_worker, [
-			(filename, extensions, variables, kwargs)
-			for filename in files
-		])
-	except Exception:
-		if ex is not None: ex.__exit__()
-		raise
-	dd = []
-	for d, w in res:
-		warnings += w
-		if d is None:
-			continue
-		dd += [d]
+			if executor is not None:
+				ex = executor
+			elif backend == 'thread':
+				ex = ThreadPoolExecutor(njobs)
+				own = True
+			else:
+				ex = ProcessPoolExecutor(njobs)
+				own = True
+			shm = transfer == 'shm' and \
+				not isinstance(ex, ThreadPoolExecutor)
+			res = [ex.submit(readdir_worker, x + (shm,)) for x in args]
+		else:
+			res = map(readdir_worker, [x + (False,) for x in args])
+		for filename, st, r in zip(files, stats, res):
+			if not isinstance(r, tuple):
+				r = r.result()
+			d, w, entry = r
+			if d is not None and shm:
+				unshare(d)
+			n += 1
+			warnings += w
+			if entry is not None and st is not None:
+				c.put(filename, st, entry)
+			if d is None:
+				continue
+			dd += [d]
+	finally:
+		if parallel:
+			for f in res[n:]:
+				f.cancel()
+			if own:
+				ex.shutdown()
+			# Temporary files of datasets read and not consumed are removed.
+			for f in res[n:]:
+				if f.cancelled() or f.exception() is not None:
+					continue
+				d = f.result()[0]
+				if d is not None and shm:
+					unshare(d)
+		if c is not None: c.close()
 	if merge is None:
 		return dd
 	else:
@@ -231,12 +504,135 @@ $ print(d['temperature'])
 		d = ds.op.merge(dd, merge, new='n')
 		return d
 
+def iterdir(dirname, variables=None, warnings=[], recursive=False,
+	prefetch=2, memory=None, backend='thread', njobs=None, transfer='shm',
+	catalog=False, **kwargs):
+	'''
+	title: iterdir
+	caption: "Iterate over data files in a directory."
+	usage: "`iterdir`(*dirname*, *variables*=`None`, *warnings*=[], *recursive*=`False`, *prefetch*=`2`, *memory*=`None`, *backend*=`'thread'`, *njobs*=`None`, *transfer*=`'shm'`, *catalog*=`False`, ...)"
+	arguments: {{
+		*dirname*: "Directory name (`str`, `bytes` or `os.PathLike`)."
+	}}
+	desc: "A generator version of **[readdir](#readdir)**, which yields datasets one by one in an alphabetical order of the files, while the following files are read ahead in the background. Only files with known extensions are read. Variable `filename` is added to the datasets, containing the name of the file. Files which cannot be read are skipped and a warning is added to *warnings*. Memory use is bounded by the number of files read ahead and *memory*, so that a large number of files can be processed one by one."
+	options: {{
+		*recursive*: "If `True`, read the directory recursively (`bool`). Otherwise only files in the top-level directory are read."
+		*variables*: "Variable names to read (`str` or `list` of `str`) or `None` to read all variables."
+		*warnings*: "A list to be populated with warnings (`list`)."
+		*prefetch*: "Maximum number of files to read ahead (`int`). If 0, files are read when the next dataset is requested."
+		*memory*: "Maximum size in bytes of data of the datasets read ahead (`int`) or `None` for no limit. The size of a file which has not been read yet is estimated from the size of the file. At least one file is always read ahead if *prefetch* is greater than 0."
+		*backend*: "Backend to read the files in (`str`): `thread` to read in background threads or `process` to read in worker processes. See **[readdir](#readdir)**."
+		*njobs*: "Number of threads or processes or `None` to use *prefetch* (limited to the number of CPU cores for the process backend)."
+		*transfer*: "Method of transfer of the datasets from worker processes (`str`). See **[readdir](#readdir)**."
+		*catalog*: "Catalog of file metadata to use (`bool` or `str`). See **[readdir](#readdir)**."
+		...: "Optional keyword arguments passed to **[read](#read)**."
+	}}
+	returns: "A generator of datasets (`dict`)."
+	examples: {{
+		"Print the mean temperature in each file in the current directory (`.`).":
+"$ for d in ds.iterdir('.', 'temperature'):
+	print(d['filename'], d['temperature'].mean())
+dataset1.nc 18.333333333333332
+dataset2.nc 25.333333333333332"
+	}}
+	'''
+	check(dirname, 'dirname', [str, bytes, os.PathLike])
+	check(variables, 'variables', [str, [list, str], [tuple, str], None])
+	check(warnings, 'warnings', list)
+	check(prefetch, 'prefetch', int)
+	check(memory, 'memory', [int, None])
+	check(backend, 'backend', str)
+	check(njobs, 'njobs', [int, None])
+	check(transfer, 'transfer', str)
+	check(catalog, 'catalog', [bool, str])
+	if backend not in ('process', 'thread'):
+		raise ValueError('invalid backend "%s"' % backend)
+	if transfer not in ('pickle', 'shm'):
+		raise ValueError('invalid transfer "%s"' % transfer)
+	if isinstance(dirname, os.PathLike): dirname = dirname.__fspath__()
+
+	files, extensions = readdir_files(dirname, recursive)
+	c = ds.catalog.open_(catalog, dirname)
+	ex = None
+	shm = False
+	if prefetch > 0:
+		if backend == 'thread':
+			ex = ThreadPoolExecutor(prefetch if njobs is None else njobs)
+		else:
+			ex = ProcessPoolExecutor(min(prefetch, os.cpu_count())
+				if njobs is None else njobs)
+			shm = transfer == 'shm'
+
+	def submit(filename):
+		st = None
+		entry = None
+		if c is not None and os.path.isfile(filename):
+			st = os.stat(filename)
+			entry = c.get(filename, st)
+		args = (filename, extensions, variables, kwargs, entry,
+			c is not None, shm)
+		if ex is None:
+			res = readdir_worker(args)
+		else:
+			res = ex.submit(readdir_worker, args)
+		return [filename, st, res, file_size(filename)]
+
+	def held(pending):
+		# Size of data of the files read ahead. The size of a file which has
+		# not been read yet is estimated from the file size.
+		n = 0
+		for p in pending:
+			if not isinstance(p[2], tuple) and p[2].done() and \
+			   p[2].exception() is None:
+				p[2] = p[2].result()
+				d = p[2][0]
+				p[3] = 0 if d is None else sum([
+					getattr(d[ds.escape(var)], 'nbytes', 0)
+					for var in ds.vars(d)
+				])
+			n += p[3]
+		return n
+
+	pending = collections.deque()
+	i = 0
+	try:
+		while i < len(files) or len(pending) > 0:
+			while i < len(files) and (len(pending) == 0 or \
+				len(pending) < prefetch and (memory is None or \
+				held(pending) + file_size(files[i]) <= memory)):
+				pending.append(submit(files[i]))
+				i += 1
+			filename, st, res, size = pending.popleft()
+			if not isinstance(res, tuple):
+				res = res.result()
+			d, w, entry = res
+			warnings += w
+			if entry is not None and st is not None:
+				c.put(filename, st, entry)
+			if d is None:
+				continue
+			if shm:
+				unshare(d)
+			yield d
+	finally:
+		if ex is not None:
+			ex.shutdown(cancel_futures=True)
+		# Temporary files of datasets read ahead and not yielded are removed.
+		for filename, st, res, size in pending:
+			if not isinstance(res, tuple):
+				if res.cancelled() or res.exception() is not None:
+					continue
+				res = res.result()
+			if res[0] is not None and shm:
+				unshare(res[0])
+		if c is not None: c.close()
+
 def write(filename, d, **kwargs):
 	'''
 	title: write
-	usage: "`write`(*filename*, *d*, *time_units*=`None`, *calendar*=`None`)"
+	usage: "`write`(*filename*, *d*, *time_units*=`None`, *calendar*=`None`, *chunks*=`None`, *compression*=`None`, *threads*=`None`)"
 	caption: "Write dataset to a file."
-	desc: "The file type is determined from the file extension."
+	desc: "The file type is determined from the file extension. Options which are not supported by the file type are ignored."
 	arguments: {{
 		*filename*: "Filename (`str`, `bytes` or `os.PathLike`)."
 		*d*: "Dataset (`dict`)."
@@ -244,6 +640,9 @@ def write(filename, d, **kwargs):
 	options: {{
 		*time_units*: "Time units to use (`str`) or `None` for no conversion. The units should comply with the CF Conventions. NetCDF4 and HDF5 only."
 		*calendar*: "Time calendar to use (`str`) or `None` for no conversion. The calendar should comply with the CF Conventions. NetCDF4 and HDF5 only."
+		*chunks*: "Chunk size of variables along dimensions (`dict`) or `None` to choose the chunk size automatically. The chunk size is a dictionary where the key is a dimension name (`str`) and the value is the chunk size (`int`). Dimensions which are not present in the dictionary are not split into chunks. Selective reading of chunked variables only reads the chunks needed. DS only."
+		*compression*: "Compression of variable data (`str` or `list` of `str`) or `None` for no compression. One of the compression codecs `zlib`, `lzma`, `bz2` or `none`, or a list of a codec and filters applied before compression. The filter `shuffle` reorders the bytes of numerical values so that bytes of the same significance are stored together. The filter `delta` stores differences between subsequent numerical values. Compressed chunks are decompressed in parallel on reading. DS only."
+		*threads*: "Number of threads to encode, compress and write variables with in parallel (`int`) or `None` to write variables sequentially. DS only."
 	}}
 	"Supported formats": {{
 		CSV/TSV: "`.csv`, `.tsv`, `.tab`"
@@ -280,6 +679,207 @@ def write(filename, d, **kwargs):
 			if isinstance(filename, bytes):
 				end = end.encode('utf-8')
 			if filename.endswith(end):
-				driver.write(filename, d, **kwargs)
+				opts = {
+					k: v for k, v in kwargs.items()
+					if k in driver.WRITE_OPTS
+				}
+				driver.write(filename, d, **opts)
 				return
 	raise ValueError('%s: Unknown file extension' % filename)
+
+def append(filename, d, dim):
+	'''
+	title: append
+	usage: "`append`(*filename*, *d*, *dim*)"
+	caption: "Append dataset to an existing file along a dimension."
+	desc: "Variables with the dimension *dim* in the file are extended with the data of the variables in *d*. Variables in the file without the dimension *dim* are left unchanged. Variables with the dimension *dim* which are not in *d* are extended with missing values. The data are converted to the type of the variables in the file. Only the appended data are written, but the existing data of variables which are not stored in chunks along *dim* are rewritten once the first time data are appended. Appending is supported only by the DS format."
+	arguments: {{
+		*filename*: "Filename (`str`, `bytes` or `os.PathLike`)."
+		*d*: "Dataset (`dict`)."
+		*dim*: "Dimension to append along (`str`)."
+	}}
+	returns: `None`
+	examples: {{
+		"Append a dataset to a file `dataset.ds` along the dimension `time`.":
+"$ ds.append('dataset.ds', {
+	'time': [4, 5, 6],
+	'temperature': [23., 25., 28.],
+	'.': {
+		'time': { '.dims': ['time'] },
+		'temperature': { '.dims': ['time'] },
+	}
+}, 'time')"
+	}}
+	'''
+	check(filename, 'filename', [str, bytes, os.PathLike])
+	check(d, 'd', dict)
+	check(dim, 'dim', str)
+	if isinstance(filename, os.PathLike): filename = filename.__fspath__()
+	for driver in DRIVERS.values():
+		for ext in driver.WRITE_EXT:
+			end = '.' + ext
+			if isinstance(filename, bytes):
+				end = end.encode('utf-8')
+			if filename.endswith(end):
+				if not hasattr(driver, 'append'):
+					raise ValueError('%s: Appending is not supported by the file type' % filename)
+				driver.append(filename, d, dim)
+				return
+	raise ValueError('%s: Unknown file extension' % filename)
+
+def merge_plan(dd, dim, new, variables, jd):
+	# Output metadata of merging datasets dd along dim, determined from their
+	# metadata only, following op.merge. For each variable, also returns the
+	# dimension it is merged along or None if it is taken from the first
+	# dataset containing it, the axis of the dimension or None if the
+	# dimension is new, the index of the first dataset containing the
+	# variable and whether time is converted to Julian date.
+	dx = {'.': {'.': {}}}
+	plan = {}
+	vars_ = sorted(list(set([x for d in dd for x in ds.vars(d, full=True)])))
+	dims = [k for d in dd for k in ds.dims(d, full=True)]
+	is_new = dim not in dims
+	for var in vars_:
+		jj = [j for j, d in enumerate(dd) if var in ds.vars(d, full=True)]
+		meta0 = ds.meta(dd[jj[0]], var)
+		dims0 = ds.dims(dd[jj[0]], var, full=True)
+		size0 = meta0.get('.size')
+		if size0 is None:
+			continue
+		if is_new and (variables is None or var in variables) or \
+		   dim in dims0:
+			mdim = dim
+		elif new is not None and (variables is None or var in variables):
+			mdim = new
+		else:
+			mdim = None
+		k = dims0.index(mdim) if mdim in dims0 else None
+		if mdim is None:
+			dims1, size1 = dims0, list(size0)
+			jj = jj[:1]
+		elif k is None:
+			dims1, size1 = [mdim] + dims0, [len(dd)] + list(size0)
+		else:
+			dims1, size1 = dims0, list(size0)
+			size1[k] = sum([ds.dim(d, mdim, full=True) for d in dd])
+		convert_time = False
+		if mdim is not None and jd:
+			units = None
+			for d in dd:
+				u = ds.attrs(d, var).get('units')
+				if units is None: units = u
+				if u != units:
+					convert_time = True
+					break
+		if convert_time:
+			# Time is only converted if the units of all datasets are time
+			# units.
+			convert_time = all([
+				ds.misc.cf_time_raw(np.array([0.]), ds.meta(dd[j], var))
+				for j in jj
+			])
+		meta = {}
+		for j in jj:
+			size = ds.meta(dd[j], var).get('.size')
+			if ds.dims(dd[j], var, full=True) != dims0:
+				raise ValueError('merge: incompatible dimensions in variable "%s"' % var)
+			if size is None or len(size) != len(size0) or \
+			   not all(i == k or size[i] == size0[i]
+			   for i in range(len(size0))):
+				raise ValueError('merge: incompatible size in variable "%s"' % var)
+			meta.update(ds.meta(dd[j], var))
+		if convert_time:
+			meta['units'] = 'days since -4713-11-24 12:00 UTC'
+			meta['calendar'] = 'proleptic_gregorian'
+			meta['.type'] = 'float64'
+			meta['.time'] = True
+		if mdim is not None and len(jj) < len(dd):
+			# Missing in some of the datasets.
+			meta['.missing'] = True
+		meta['.dims'] = dims1
+		meta['.size'] = size1
+		meta.setdefault('.type', 'float64')
+		ds.meta(dx, var, meta)
+		plan[var] = (mdim, k, jj[0], convert_time)
+	for d in dd:
+		dx['.']['.'].update(ds.meta(d, ''))
+	return dx, plan
+
+def merge_slices(input_, dd, dx, plan, r):
+	# Iterate over the inputs, yielding for each of them the parts of the
+	# output variables it contributes as a dictionary of a variable name and
+	# a pair of a selector of the part in the output and the data. Merged
+	# variables missing in an input are yielded as missing values.
+	pos = {}
+	for i, filename in enumerate(input_):
+		names = [
+			var for var, (mdim, k, j0, convert_time) in plan.items()
+			if mdim is not None or j0 == i
+		]
+		d = read(filename, [
+			var for var in names if var in ds.vars(dd[i], full=True)
+		], **r)
+		res = {}
+		for var in names:
+			mdim, k, j0, convert_time = plan[var]
+			size = ds.meta(dx, var)['.size']
+			s = [slice(None)]*len(size)
+			if mdim is not None and k is None:
+				n1 = 1
+				s[0] = slice(i, i + 1)
+			elif mdim is not None:
+				n1 = ds.dim(dd[i], mdim, full=True)
+				p = pos.get(mdim, 0)
+				s[k] = slice(p, p + n1)
+			if var in ds.vars(d):
+				x = ds.var(d, var)
+				if convert_time:
+					d2 = {}
+					ds.var(d2, var, x)
+					ds.meta(d2, var, ds.meta(d, var))
+					ds.misc.process_cf_time_var(d2, var)
+					x = ds.var(d2, var)
+				if mdim is not None and k is None:
+					x = x[np.newaxis]
+			else:
+				shape = [
+					size[j] if s[j] == slice(None) else n1
+					for j in range(len(size))
+				]
+				dt = ds.misc.type_to_dtype(ds.meta(dx, var)['.type'])
+				x = np.ma.array(np.zeros(shape, dt), mask=True)
+			res[var] = (tuple(s), x)
+		for mdim in set([p[0] for p in plan.values() if p[1] is not None]):
+			pos[mdim] = pos.get(mdim, 0) + ds.dim(dd[i], mdim, full=True)
+		yield res
+
+def merge_files(input_, output, dim, new=None, variables=None, jd=True,
+	F=False, r={}, w={}):
+	# Merge files without loading them all in memory. The output size is
+	# determined from the metadata of the inputs, and the inputs are then
+	# read one by one and written to the output by parts. Selection on
+	# reading and time conversion on writing need the inputs in memory, in
+	# which case they are merged with op.merge.
+	driver = None
+	for driver1 in DRIVERS.values():
+		for ext in driver1.WRITE_EXT:
+			if output.endswith('.' + ext):
+				driver = driver1
+	if any([k in r for k in ('sel', 'range_', 'at', 'between')]) or \
+	   'time_units' in w or 'calendar' in w or \
+	   not hasattr(driver, 'create'):
+		dd = [read(filename, **r) for filename in input_]
+		if not F and len(dd) > 0:
+			dim = ds.find(dd[0], 'dim', dim)
+		d = ds.op.merge(dd, dim, new=new, variables=variables, jd=jd)
+		write(output, d, **w)
+		return
+	dd = [read(filename, [], full=True, **r) for filename in input_]
+	if not F and len(dd) > 0:
+		dim = ds.find(dd[0], 'dim', dim)
+	dx, plan = merge_plan(dd, dim, new, variables, jd)
+	opts = {k: v for k, v in w.items() if k in driver.WRITE_OPTS}
+	with driver.create(output, dx, **opts) as f:
+		for res in merge_slices(input_, dd, dx, plan, r):
+			for var, (s, x) in res.items():
+				driver.write_slice(f, var, s, x)
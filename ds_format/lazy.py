@@ -0,0 +1,107 @@
+import numpy as np
+import ds_format as ds
+from ds_format import misc
+
+# Proxy to variable data in a file, which are read on first access. The file
+# is reopened when the data are read. Taking a subset of the proxy with take
+# only records the selection, which is passed to the driver when reading.
+# Arrays of indexes are passed to the driver for one dimension only, because
+# not all drivers support them on multiple dimensions. Arrays of indexes of
+# other dimensions are recorded in post and applied after reading.
+class LazyArray(object):
+	def __init__(self, filename, var, dims, shape, type_, sel={}, opts={},
+		jd=False, post={}):
+		self.filename = filename
+		self.var = var
+		self.dims = list(dims)
+		self.shape = tuple(shape)
+		self.type_ = type_
+		self.sel = sel
+		self.opts = opts
+		self.jd = jd
+		self.post = post
+		self._data = None
+
+	@property
+	def ndim(self):
+		return len(self.shape)
+
+	@property
+	def size(self):
+		return int(np.prod(self.shape))
+
+	@property
+	def dtype(self):
+		return misc.type_to_dtype(self.type_)
+
+	def take(self, idxs, axis):
+		dim = self.dims[axis]
+		n = self.shape[axis]
+		sel = dict(self.sel)
+		post = dict(self.post)
+		if isinstance(idxs, slice):
+			r = range(n)[idxs]
+			if dim in post:
+				post[dim] = post[dim][idxs]
+			else:
+				sel[dim] = misc.sel_take(sel[dim], idxs) if dim in sel \
+					else misc.range_slice(r)
+			shape = list(self.shape)
+			shape[axis] = len(r)
+			return LazyArray(self.filename, self.var, self.dims, shape,
+				self.type_, sel, self.opts, self.jd, post)
+		if isinstance(idxs, np.ndarray):
+			idxs = np.where(idxs < 0, idxs + n, idxs)
+			if np.any((idxs < 0) | (idxs >= n)):
+				raise IndexError('index out of bounds')
+		else:
+			idxs = idxs + n if idxs < 0 else idxs
+			if idxs < 0 or idxs >= n:
+				raise IndexError('index out of bounds')
+		if dim in post:
+			post[dim] = post[dim][idxs]
+		elif isinstance(idxs, np.ndarray) and \
+		   not isinstance(sel.get(dim), np.ndarray) and \
+		   any([isinstance(x, np.ndarray) for x in sel.values()]):
+			post[dim] = idxs
+		else:
+			sel[dim] = misc.sel_take(sel[dim], idxs) if dim in sel else idxs
+		dims = list(self.dims)
+		shape = list(self.shape)
+		if isinstance(idxs, np.ndarray):
+			shape[axis] = len(idxs)
+		else:
+			del dims[axis]
+			del shape[axis]
+		return LazyArray(self.filename, self.var, dims, shape, self.type_,
+			sel, self.opts, self.jd, post)
+
+	def load(self):
+		if self._data is None:
+			d = ds.read(self.filename, [self.var],
+				sel=(self.sel if len(self.sel) > 0 else None),
+				**self.opts
+			)
+			data = ds.var(d, self.var)
+			if len(self.post) > 0:
+				data = misc.sel_apply(data, [
+					self.post.get(dim, slice(None))
+					for dim in ds.dims(d, self.var)
+				])
+			self._data = data
+		return self._data
+
+	def __array__(self, dtype=None, copy=None):
+		return np.asarray(self.load(), dtype=dtype)
+
+	def __getitem__(self, s):
+		return self.load()[s]
+
+	def __len__(self):
+		if self.ndim == 0:
+			raise TypeError('len() of unsized object')
+		return self.shape[0]
+
+	def __repr__(self):
+		return 'LazyArray(%r, %r, shape=%r)' % (
+			self.filename, self.var, self.shape)
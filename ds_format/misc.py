@@ -1,13 +1,12 @@
 import datetime as dt
 import json
+import math
 import ds_format as ds
 import numpy as np
 from contextlib import contextmanager
 import re
-import cftime
-import aquarius_time as aq
-import pst
 import inspect
+import weakref
 
 KIND_TO_TYPE = {
 	'f': 'float',
@@ -34,6 +33,197 @@ TYPE_TO_DTYPE = {
 	'unicode': np.dtype('object'),
 }
 
+# Properties of coordinate arrays computed by monotonic and sort_index, by
+# the array id. The entries are removed when the arrays are deleted, and
+# recomputed if the fingerprint of the array has changed. Arrays modified in
+# place only at elements which are not sampled by the fingerprint are not
+# rechecked.
+MONOTONIC = {}
+SORT_INDEX = {}
+
+# Number of elements of an array sampled by fingerprint.
+FINGERPRINT_SAMPLES = 16
+
+def fingerprint(data):
+	# Data address, shape and strides of an array, and the values and mask
+	# of evenly spaced elements including the first and last one.
+	x = np.ma.getdata(data)
+	res = (x.__array_interface__['data'][0], x.shape, x.strides)
+	if x.size == 0:
+		return res
+	ii = np.unique(np.linspace(0, x.size - 1,
+		FINGERPRINT_SAMPLES).astype(int))
+	idx = np.unravel_index(ii, x.shape)
+	mask = np.ma.getmask(data)
+	return res + (
+		x[idx].tobytes(),
+		None if mask is np.ma.nomask else mask[idx].tobytes(),
+	)
+
+def cached(cache, data, func):
+	if not isinstance(data, np.ndarray):
+		return func(data)
+	k = id(data)
+	res = cache.get(k)
+	fp = fingerprint(data)
+	if res is not None and res[0]() is data and res[1] == fp:
+		return res[2]
+	x = func(data)
+	try: ref = weakref.ref(data, lambda ref: cache.pop(k, None))
+	except TypeError: return x
+	cache[k] = (ref, fp, x)
+	return x
+
+def monotonic(data):
+	# 1 if data are non-decreasing, -1 if non-increasing, otherwise 0.
+	def f(data):
+		if not (isinstance(data, np.ndarray) and data.ndim == 1 and \
+		   data.dtype.kind in 'iuf' and not np.ma.is_masked(data)):
+			return 0
+		x = np.ma.getdata(data)
+		if np.all(x[1:] >= x[:-1]):
+			return 1
+		if np.all(x[1:] <= x[:-1]):
+			return -1
+		return 0
+	return cached(MONOTONIC, data, f)
+
+def sort_index(data):
+	# Sorted valid values of data flattened and their flat indexes, or None
+	# in place of the indexes if data are sorted.
+	def f(data):
+		x = np.ma.getdata(data).ravel()
+		if monotonic(data) > 0 and \
+		   not (x.dtype.kind == 'f' and np.isnan(x).any()):
+			return x, None
+		valid = ~np.ma.getmaskarray(data).ravel()
+		if x.dtype.kind == 'f':
+			valid &= ~np.isnan(x)
+		ii = np.nonzero(valid)[0]
+		ii = ii[np.argsort(x[ii], kind='stable')]
+		return x[ii], ii
+	return cached(SORT_INDEX, data, f)
+
+def nearest(data, xx):
+	# Flat indexes of values of data nearest to xx. Of equally near values,
+	# the first one is chosen.
+	v, ii = sort_index(data)
+	xx = np.asarray(xx)
+	if len(v) == 0:
+		return np.zeros(xx.shape, int)
+	j = np.searchsorted(v, xx)
+	hi = np.minimum(j, len(v) - 1)
+	lo = np.searchsorted(v, v[np.maximum(j - 1, 0)], 'left')
+	if ii is not None:
+		lo_i, hi_i = ii[lo], ii[hi]
+	else:
+		lo_i, hi_i = lo, hi
+	dlo = np.abs(v[lo] - xx)
+	dhi = np.abs(v[hi] - xx)
+	return np.where(dlo < dhi, lo_i,
+		np.where(dhi < dlo, hi_i, np.minimum(lo_i, hi_i)))
+
+def range_slice(r):
+	return slice(r.start, r.stop if r.stop >= 0 else None, r.step)
+
+def slice_range(s):
+	# Inverse of range_slice.
+	return range(s.start, s.stop if s.stop is not None else -1, s.step or 1)
+
+def sel_take(jj, ii):
+	# Index a selector jj by ii. Slices are kept as slices.
+	if isinstance(jj, slice):
+		r = slice_range(jj)
+		if isinstance(ii, slice):
+			return range_slice(r[ii])
+		if isinstance(ii, (np.ndarray, list, tuple)):
+			return np.arange(r.start, r.stop, r.step)[ii]
+		return r[ii]
+	return jj[ii]
+
+def slice_to_range(s, n):
+	# Increasing range of indexes selected by a slice s along a dimension of
+	# size n.
+	r = range(n)[s]
+	return r[::-1] if r.step < 0 else r
+
+def range_intersect(r1, r2):
+	# Intersection of two increasing ranges. The first common index solves
+	# x = r1.start (mod r1.step) and x = r2.start (mod r2.step).
+	g = math.gcd(r1.step, r2.step)
+	if len(r1) == 0 or len(r2) == 0 or (r2.start - r1.start) % g != 0:
+		return range(0)
+	m1, m2 = r1.step//g, r2.step//g
+	k = (r2.start - r1.start)//g*pow(m1, -1, m2) % m2
+	step = m1*r2.step
+	x = r1.start + k*r1.step
+	start = max(r1.start, r2.start)
+	x += -(-(start - x)//step)*step
+	return range(x, max(x, min(r1.stop, r2.stop)), step)
+
+def sel_intersect(a, b, n):
+	# Intersection of two selectors of indexes along a dimension of size n.
+	if isinstance(b, slice):
+		a, b = b, a
+	if isinstance(b, slice):
+		return range_slice(range_intersect(slice_to_range(a, n),
+			slice_to_range(b, n)))
+	ii = np.asarray(b)
+	if ii.dtype == np.bool_:
+		ii = np.nonzero(ii)[0]
+	ii = np.where(ii < 0, ii + n, ii)
+	if not isinstance(a, slice):
+		jj = np.asarray(a)
+		return np.intersect1d(np.where(jj < 0, jj + n, jj), ii)
+	r = slice_to_range(a, n)
+	ii = np.unique(ii)
+	return ii[(ii >= r.start) & (ii < r.stop) & ((ii - r.start) % r.step == 0)]
+
+def between_slice(data, b1, b2):
+	# Range of indexes of monotonic data between b1 and b2.
+	n = len(data)
+	x = np.ma.getdata(data)
+	if monotonic(data) > 0:
+		i1 = 0 if b1 is None else np.searchsorted(x, b1, 'left')
+		i2 = n if b2 is None else np.searchsorted(x, b2, 'left')
+	else:
+		r = x[::-1]
+		i1 = 0 if b2 is None else n - np.searchsorted(r, b2, 'left')
+		i2 = n if b1 is None else n - np.searchsorted(r, b1, 'left')
+	return slice(int(i1), int(max(i1, i2)))
+
+def sel_apply(data, s):
+	# Index data by a sequence of selectors for each dimension (an index, a
+	# slice or an array of indexes). Indexes and slices are applied first,
+	# which gives a view. Arrays of indexes are applied orthogonally, with
+	# one np.ix_ if they are on adjacent dimensions, otherwise with one take
+	# for each, starting from the one which reduces the data the most.
+	basic = []
+	arrays = []
+	axis = 0
+	for x in s:
+		if isinstance(x, (np.ndarray, list, tuple)):
+			x = np.asarray(x)
+			if x.dtype == np.bool_:
+				x = np.nonzero(x)[0]
+			arrays += [(axis, np.atleast_1d(x))]
+			x = slice(None)
+		basic += [x]
+		if isinstance(x, slice):
+			axis += 1
+	data = data[tuple(basic)]
+	if len(arrays) == 0:
+		return data
+	if len(arrays) == 1:
+		return np.take(data, arrays[0][1], axis=arrays[0][0])
+	axes = [a for a, _ in arrays]
+	if axes == list(range(axes[0], axes[0] + len(axes))):
+		return data[(slice(None),)*axes[0] + np.ix_(*[x for _, x in arrays])]
+	arrays = sorted(arrays, key=lambda a: len(a[1])/max(data.shape[a[0]], 1))
+	for axis, x in arrays:
+		data = np.take(data, x, axis=axis)
+	return data
+
 def sel_slice(sel, dims):
 	return tuple([
 		slice(None) if dim not in sel.keys() else sel[dim]
@@ -45,85 +235,181 @@ def sel_dims(sel, dims):
 		dim
 		for dim in dims
 		if dim not in sel.keys() or \
-			isinstance(sel[dim], np.ndarray) or \
+			isinstance(sel[dim], (np.ndarray, slice)) or \
 			type(sel[dim]) in (list, tuple)
 	]
 
 def sel_from_range(d, range_):
 	def norm(side, x, dim):
 		if x is None:
-			return 0 if side == 1 else ds.dim(d, dim)
+			return 0 if side == 1 else ds.dim(d, dim, full=True)
 		elif x >= 0:
 			return x
 		else:
-			return ds.dim(d, dim) + x
-	return {
-		dim: np.arange(norm(1, r[0], dim), norm(2, r[1], dim), dtype=int)
-		for dim, r in range_.items()
-	}
+			return max(ds.dim(d, dim, full=True) + x, 0)
+	sel = {}
+	for dim, r in range_.items():
+		start = norm(1, r[0], dim)
+		sel[dim] = slice(start, max(norm(2, r[1], dim), start))
+	return sel
 
-def sel_from_at(d, at):
+def sel_from_at(d, at, pre={}):
+	import aquarius_time as aq
 	sel = {}
 	for var, v in at.items():
 		sel_var = {}
 		dims = ds.dims(d, var)
-		def process(x):
-			if isinstance(x, str):
-				x = aq.from_iso(x)
-				res = get_time_var(d, var)
-				if res is not None:
-					data = res[0]
-			else:
-				data = ds.var(d, var)
-			ii = np.argmin(np.abs(data - x))
-			if len(dims) <= 1:
-				ii = [ii]
-			for dim, i in zip(dims, ii):
-				sel_var[dim] = np.union1d(sel_var[dim], i) \
-					if dim in sel_var else i
-		if isinstance(v, np.ndarray) or type(v) in (list, tuple):
-			[process(v1) for v1 in v]
-		else:
-			process(v)
+		jj = pre[var][0] if var in pre else None
+		xx = v if isinstance(v, np.ndarray) or type(v) in (list, tuple) \
+			else [v]
+		data = pre[var][1] if var in pre else ds.var(d, var)
+		if any([isinstance(x, str) for x in xx]):
+			xx = [aq.from_iso(x) if isinstance(x, str) else x for x in xx]
+			res = get_time_var(d, var)
+			if res is not None:
+				data = res[0]
+		ii = nearest(data, xx)
+		if jj is not None:
+			ii = sel_take(jj, ii)
+		ii = np.unravel_index(ii, np.shape(data)) if len(dims) > 1 else [ii]
+		for dim, i in zip(dims, ii):
+			sel_var[dim] = int(i[0]) if len(i) == 1 else np.unique(i)
 		for dim, v in sel_var.items():
-			sel[dim] = np.intersect1d(sel[dim], v) \
+			sel[dim] = sel_intersect(sel[dim], v, ds.dim(d, dim, full=True)) \
 				if dim in sel else v
 	return sel
 
-def sel_from_between(d, between):
+def sel_from_between(d, between, pre={}):
+	import aquarius_time as aq
 	sel = {}
 	for var, b in between.items():
-		for i, b1 in enumerate([b[0], b[1]]):
+		bb = []
+		for b1 in [b[0], b[1]]:
 			if isinstance(b1, str):
 				b1 = aq.from_iso(b1)
 				res = get_time_var(d, var)
 				if res is not None:
 					data = res[0]
 			else:
-				data = ds.var(d, var)
-			if i == 0:
-				mask = data >= b1 \
-					if b1 is not None else np.ones(data.shape, bool)
-			else:
-				mask &= data < b1 \
-					if b1 is not None else np.ones(data.shape, bool)
-		ii = np.where(mask)[0]
-		sel[var] = ii
+				data = pre[var][1] if var in pre else ds.var(d, var)
+			bb += [(b1, data)]
+		(b1, data1), (b2, data2) = bb
+		if data1 is data2 and monotonic(data1) != 0:
+			ii = between_slice(data1, b1, b2)
+		else:
+			mask = data1 >= b1 \
+				if b1 is not None else np.ones(data1.shape, bool)
+			mask &= data2 < b2 \
+				if b2 is not None else np.ones(data2.shape, bool)
+			ii = np.where(mask)[0]
+		sel[var] = sel_take(pre[var][0], ii) if var in pre else ii
 	return sel
 
-def sel_merge(sels):
-	sel = {}
+def chunk_range(meta, test):
+	# Indexes of a 1-D variable in chunks whose statistics pass test (a slice
+	# if the chunks are consecutive), or None if the variable has no chunk
+	# statistics.
+	if len(meta.get('.dims', [])) != 1 or '.chunk_min' not in meta:
+		return None
+	n = meta['.size'][0]
+	c = meta['.chunks'][0]
+	kk = [
+		k for k, (min_, max_) in
+		enumerate(zip(meta['.chunk_min'], meta['.chunk_max']))
+		if min_ is not None and test(min_, max_)
+	]
+	if len(kk) == 0:
+		return slice(0, 0)
+	if kk[-1] - kk[0] + 1 == len(kk):
+		return slice(kk[0]*c, min((kk[-1] + 1)*c, n))
+	return np.concatenate([np.arange(k*c, min((k + 1)*c, n)) for k in kk])
+
+def sel_union(a, b):
+	# Union of two selectors of indexes returned by chunk_range.
+	if isinstance(a, slice) and isinstance(b, slice) and \
+	   a.start <= b.stop and b.start <= a.stop:
+		return slice(min(a.start, b.start), max(a.stop, b.stop))
+	ii = np.union1d(*[
+		np.arange(x.start, x.stop) if isinstance(x, slice) else x
+		for x in (a, b)
+	])
+	if len(ii) > 0 and ii[-1] - ii[0] + 1 == len(ii):
+		return slice(int(ii[0]), int(ii[-1]) + 1)
+	return ii
+
+def sel_prune(d, at, between):
+	# Determine indexes of selector variables which can satisfy at and
+	# between conditions from chunk statistics stored in the metadata, so
+	# that only these parts of the variables need to be read.
+	pre = {}
+	for var, b in (between or {}).items():
+		if var not in ds.vars(d, full=True) or \
+		   isinstance(b[0], str) or isinstance(b[1], str):
+			continue
+		ii = chunk_range(ds.meta(d, var), lambda min_, max_:
+			(b[0] is None or max_ >= b[0]) and \
+			(b[1] is None or min_ < b[1])
+		)
+		if ii is not None:
+			pre[var] = ii
+	for var, v in (at or {}).items():
+		if var not in ds.vars(d, full=True):
+			continue
+		meta = ds.meta(d, var)
+		xx = v if isinstance(v, np.ndarray) or type(v) in (list, tuple) \
+			else [v]
+		if any([isinstance(x, str) for x in xx]) or \
+		   sum(meta.get('.chunk_nans', [1])) > 0:
+			# The variable is read whole.
+			pre.pop(var, None)
+			continue
+		# The nearest value in a chunk is not farther than its minimum or
+		# maximum, and not nearer than the distance from its range.
+		limit = [
+			min([
+				min(abs(min_ - x), abs(max_ - x))
+				for min_, max_ in zip(meta['.chunk_min'], meta['.chunk_max'])
+				if min_ is not None
+			] or [np.inf])
+			for x in xx
+		]
+		ii = chunk_range(meta, lambda min_, max_: any([
+			max(min_ - x, x - max_, 0) <= lim
+			for x, lim in zip(xx, limit)
+		]))
+		if ii is None:
+			pre.pop(var, None)
+		elif var in pre:
+			# The variable is also pruned by between. The union of the parts
+			# contains all candidates for both.
+			pre[var] = sel_union(pre[var], ii)
+		else:
+			pre[var] = ii
+	return pre
+
+def sel_merge(d, sels):
+	# Slices are intersected first, and arrays of indexes from the shortest,
+	# so that np.intersect1d is called on as few elements as possible.
+	sel_all = {}
 	for sel1 in sels:
 		if sel1 is None: continue
 		for dim, ii in sel1.items():
-			sel[dim] = np.intersect1d(sel[dim], ii) if dim in sel else ii
+			sel_all.setdefault(dim, []).append(ii)
+	sel = {}
+	for dim, iii in sel_all.items():
+		iii = sorted(iii, key=lambda ii: (not isinstance(ii, slice),
+			np.size(ii) if not isinstance(ii, slice) else 0))
+		sel[dim] = iii[0]
+		for ii in iii[1:]:
+			sel[dim] = sel_intersect(sel[dim], ii, ds.dim(d, dim, full=True))
 	return sel
 
-def sel_from_any(d, sel, range_, at, between):
+def sel_from_any(d, sel, range_, at, between, pre={}):
 	sel_range = sel_from_range(d, range_) if range_ is not None else None
-	sel_at = sel_from_at(d, at) if at is not None else None
-	sel_between = sel_from_between(d, between) if between is not None else None
-	return sel_merge([sel, sel_range, sel_at, sel_between])
+	sel_at = sel_from_at(d, at, pre) if at is not None else None
+	sel_between = sel_from_between(d, between, pre) \
+		if between is not None else None
+	return sel_merge(d, [sel, sel_range, sel_at, sel_between])
 
 def encoder(x):
 	if isinstance(x, np.generic):
@@ -194,6 +480,8 @@ def with_mode(mode):
 	ds.mode = tmp
 
 def cf_time_raw(data, meta):
+	import cftime
+	import aquarius_time as aq
 	if not isinstance(data, (np.ndarray, np.generic)):
 		return
 	x = data.flatten()
@@ -251,6 +539,7 @@ def cf_time(
 	if units == 'days since -4713-11-24 12:00 UTC' and \
 		calendar == 'proleptic_gregorian':
 		return data
+	import cftime
 	x = data.flatten()
 	shape = data.shape
 	mask = ~np.ma.getmaskarray(x)
@@ -357,6 +646,7 @@ def encode(x):
 		indent = 4 if ds.indent else None
 		return json.dumps(x, cls=JSONEncoder, indent=indent).encode('utf-8')
 	else:
+		import pst
 		return pst.encode(x, encoder=encoder, indent=ds.indent)
 
 def read_opts(opts, sel=False):
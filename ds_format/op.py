@@ -5,11 +5,14 @@ import numpy as np
 import copy as copy_
 import datetime as dt
 import warnings
+import weakref
 from warnings import warn
 from collections.abc import Mapping, Iterable
 import ds_format as ds
 from ds_format.misc import check
 from . import misc
+from .lazy import LazyArray
+from .dataset import Dataset
 
 #
 # Private variables.
@@ -39,6 +42,7 @@ def select_var(d, var, sel):
 	var_e = ds.escape(var)
 	var_dims = ds.dims(d, var)
 	d['.'][var_e]['.dims'] = var_dims
+	s = [slice(None)]*len(var_dims)
 	for k, v in sel.items():
 		if isinstance(v, Mapping):
 			if len(sel) > 1: raise ValueError('invalid selector')
@@ -61,11 +65,28 @@ def select_var(d, var, sel):
 			if isinstance(idxs, np.ndarray) and idxs.dtype == np.bool_:
 				idxs = np.nonzero(idxs)[0]
 			if dim in var_dims:
-				i = var_dims.index(dim)
-				data = ds.var(d, var)
-				ds.var(d, var, np.take(data, idxs, axis=i))
-				if not isinstance(idxs, np.ndarray):
-					var_dims.remove(dim)
+				data = d.get(var_e)
+				if isinstance(data, LazyArray):
+					d[var_e] = data.take(idxs, axis=data.dims.index(dim))
+				else:
+					s[var_dims.index(dim)] = idxs
+	if any([not isinstance(x, slice) or x != slice(None) for x in s]):
+		data = ds.var(d, var)
+		ds.var(d, var, misc.sel_apply(data, s))
+	for dim, idxs in sel.items():
+		if dim in var_dims and \
+		   not isinstance(idxs, (np.ndarray, list, tuple, slice)):
+			var_dims.remove(dim)
+	touch(d)
+
+def has_var(d, var, full=False):
+	if isinstance(d, Dataset) and (d.has_var(var) or not full):
+		return d.has_var(var)
+	return var in ds.vars(d, full=full)
+
+def touch(d):
+	if isinstance(d, Dataset):
+		d.invalidate()
 
 def is_hidden(x):
 	return isinstance(x, bytes) and x.startswith(b'.') or \
@@ -100,9 +121,8 @@ def time_dt(time):
 
 def merge_var(dd, var, dim, jd=True):
 	for d in dd:
-		if var not in ds.vars(d):
+		if not has_var(d, var):
 			continue
-		x = ds.var(d, var)
 		dims0 = ds.dims(d, var)
 		size0 = ds.size(d, var)
 		type_ = ds.type(d, var)
@@ -117,6 +137,8 @@ def merge_var(dd, var, dim, jd=True):
 	if jd:
 		units = None
 		for d in dd:
+			if not has_var(d, var):
+				continue
 			attrs = ds.attrs(d, var)
 			u = attrs.get('units')
 			if units is None: units = u
@@ -124,20 +146,17 @@ def merge_var(dd, var, dim, jd=True):
 				convert_time = True
 				break
 
-	if k is None: # New dimension.
-		n = len(dd)
-		dims = [dim] + dims0
-		size = [n] + size0
-	else: # Existing dimension.
-		n = np.sum([ds.dim(d, dim) for d in dd])
-		dims = dims0
-		size = copy_.deepcopy(size0)
-		size[k] = n
-
-	x = np.ma.array(np.zeros(size, dt), mask=np.ones(size, bool))
-	i = 0
+	# Parts of the output, with the number of elements along the merge
+	# dimension in place of missing parts.
+	xx = []
+	dense = True
 	meta = {}
 	for d in dd:
+		n1 = 1 if k is None else int(ds.dim(d, dim))
+		if not has_var(d, var):
+			xx.append(n1)
+			dense = False
+			continue
 		if convert_time:
 			d2 = {}
 			ds.var(d2, var, ds.var(d, var))
@@ -145,10 +164,6 @@ def merge_var(dd, var, dim, jd=True):
 			misc.process_cf_time_var(d2, var)
 			d = d2
 		x1 = ds.var(d, var)
-		n1 = 1 if k is None else ds.dim(d, dim)
-		if var not in ds.vars(d):
-			i += n1
-			continue
 		dims1 = ds.dims(d, var)
 		size1 = ds.size(d, var)
 		if dims1 != dims0:
@@ -156,19 +171,56 @@ def merge_var(dd, var, dim, jd=True):
 		if len(size0) != len(size1) or \
 		   not all(i == k or size1[i] == size0[i] for i in range(len(size0))):
 			raise ValueError('merge: incompatible size in variable "%s"' % var)
-		if k is None:
-			sel = [i] + [slice(None) for j in range(len(size0))]
+		if x1 is None:
+			xx.append(n1)
+			dense = False
 		else:
-			sel = [slice(i, i + n1) if j == k else slice(None) \
-				for j in range(len(size))]
-		x[tuple(sel)] = x1 if x1 is not None else np.ma.masked
+			if not isinstance(x1, np.ndarray):
+				x1 = np.asarray(x1)
+			if np.ma.is_masked(x1):
+				dense = False
+			xx.append(x1)
 		meta.update(ds.meta(d, var))
-		i += n1
+	if convert_time:
+		for x1 in xx:
+			if not isinstance(x1, int):
+				dt = x1.dtype
+				break
+
+	if k is None: # New dimension.
+		dims = [dim] + dims0
+		size = [len(dd)] + size0
+	else: # Existing dimension.
+		dims = dims0
+		size = copy_.deepcopy(size0)
+		size[k] = np.sum([ds.dim(d, dim) for d in dd])
 	meta['.dims'] = dims
+
+	if dense:
+		xx = [np.ma.getdata(x1) for x1 in xx]
+		if k is None:
+			xx = [x1[np.newaxis] for x1 in xx]
+		x = np.concatenate(xx, axis=(0 if k is None else k), dtype=dt,
+			casting='unsafe')
+		return x, meta
+
+	x = np.ma.array(np.zeros(size, dt), mask=np.ones(size, bool))
+	i = 0
+	for x1 in xx:
+		n1 = x1 if isinstance(x1, int) else \
+			1 if k is None else x1.shape[k]
+		if not isinstance(x1, int):
+			if k is None:
+				sel = [i] + [slice(None) for j in range(len(size0))]
+			else:
+				sel = [slice(i, i + n1) if j == k else slice(None) \
+					for j in range(len(size))]
+			x[tuple(sel)] = x1
+		i += n1
 	return x, meta
 
 def copy(d):
-	d2 = {}
+	d2 = Dataset() if isinstance(d, Dataset) else {}
 	for var in ds.vars(d):
 		data = ds.var(d, var)
 		ds.var(d2, var, data)
@@ -176,6 +228,19 @@ def copy(d):
 	ds.meta(d2, None, copy_.deepcopy(meta))
 	return d2
 
+# Object arrays validated by normalize_var by their id. Validation of object
+# arrays checks every item, which is skipped for arrays already validated.
+# The entries are removed when the arrays are deleted.
+NORMALIZED = {}
+
+def is_normalized(data):
+	ref = NORMALIZED.get(id(data))
+	return ref is not None and ref() is data
+
+def set_normalized(data):
+	k = id(data)
+	NORMALIZED[k] = weakref.ref(data, lambda ref: NORMALIZED.pop(k, None))
+
 def normalize_var(data):
 	if isinstance(data, (list, tuple)):
 		with warnings.catch_warnings():
@@ -195,14 +260,16 @@ def normalize_var(data):
 		isinstance(data, (np.ndarray, np.generic)) and ( \
 		data.dtype.name in ALLOWED_TYPES or \
 		data.dtype.name.startswith(('str', 'bytes')) or \
-		(data.dtype.name == 'object' and \
+		(data.dtype.name == 'object' and (is_normalized(data) or \
 		all([
 			isinstance(x, (str, bytes)) or x is None or np.ma.is_masked(x)
 			for x in data.flatten()
-		]))):
+		])))):
 		if isinstance(data, np.ndarray) and data.ndim == 0:
 			return data[()]
 		else:
+			if isinstance(data, np.ndarray) and data.dtype.name == 'object':
+				set_normalized(data)
 			return data
 	else:
 		raise ValueError('invalid data type')
@@ -350,6 +417,7 @@ $ ds.attr(d, 'units', var='temperature')
 	elif len(value) == 1:
 		meta = ds.meta(d, '' if var is None else var, create=True)
 		meta[ds.escape(attr)] = value[0]
+		touch(d)
 	else:
 		raise TypeError('only one value argument is expected')
 
@@ -461,19 +529,25 @@ $ ds.dims(d)
 	check(var, 'var', [str, None])
 	if len(value) == 0:
 		if var is None:
+			if isinstance(d, Dataset) and (size, full) in d._dims:
+				dims = d._dims[(size, full)]
+				return dict(dims) if size else list(dims)
 			if size:
 				dims = {}
 				for name in ds.vars(d, full):
 					var_dims = ds.dims(d, name, size=True)
 					for k, v in var_dims.items():
 						dims[k] = v
-				return dims
 			else:
 				dims = set()
 				for name in ds.vars(d, full):
 					var_dims = ds.dims(d, name)
 					dims |= set(var_dims)
-				return sorted(list(dims))
+				dims = sorted(list(dims))
+			if isinstance(d, Dataset):
+				d._dims[(size, full)] = dims
+				return dict(dims) if size else list(dims)
+			return dims
 		else:
 			meta = ds.meta(d, var)
 			if '.dims' in meta:
@@ -481,8 +555,10 @@ $ ds.dims(d)
 			else:
 				var_dims = gen_dims(d, var)
 			if size:
-				with ds.with_mode('soft'):
-					data = ds.var(d, var)
+				data = d.get(ds.escape(var))
+				if not isinstance(data, LazyArray):
+					with ds.with_mode('soft'):
+						data = ds.var(d, var)
 				var_size = meta.get('.size')
 				dims = {}
 				for i, dim in enumerate(var_dims):
@@ -510,6 +586,7 @@ $ ds.dims(d)
 				del meta['.dims']
 		else:
 			meta['.dims'] = value[0]
+		touch(d)
 	else:
 		raise TypeError('only one value argument is expected')
 
@@ -694,7 +771,7 @@ $ print(d['temperature'])
 	for var in vars_:
 		var_dims = None
 		for d in dd:
-			if var in ds.vars(d):
+			if has_var(d, var):
 				var_dims = ds.dims(d, var)
 				break
 		if is_new and (variables is None or var in variables) or \
@@ -783,6 +860,7 @@ ds.meta(d, 'temperature', { '.dims': ['new_time'], 'long_name': 'new temperature
 					del ds_meta[var_e]
 			else:
 				ds_meta[var_e] = value[0]
+		touch(d)
 	else:
 		raise TypeError('only one value argument is expected')
 
@@ -1027,7 +1105,7 @@ True"
 	check(name, 'name', str)
 	check(var, 'var', [str, None])
 	if what == 'var':
-		if name in ds.vars(d, full=full):
+		if has_var(d, name, full=full):
 			return True
 	elif what == 'dim':
 		dims = ds.dims(d, var, full=full)
@@ -1079,6 +1157,7 @@ $ ds.vars(d)
 		del d[var_e]
 	if var_e in meta:
 		del meta[var_e]
+	touch(d)
 
 def rm_attr(d, attr, var=None):
 	'''
@@ -1115,6 +1194,7 @@ $ ds.attrs(d)
 	if require(d, 'attr', attr, var):
 		meta = ds.meta(d, '' if var is None else var)
 		del meta[ds.escape(attr)]
+		touch(d)
 
 def select(d, sel=None, range_=None, at=None, between=None):
 	'''
@@ -1126,7 +1206,7 @@ def select(d, sel=None, range_=None, at=None, between=None):
 		*d*: "Dataset (`dict`)."
 	}}
 	options: {{
-		*sel*: "Selector (`dict`). The selector is a dictionary where the key is a dimension name (`str`) and the value is a mask, a list of indexes (`list` or `np.array`) or an index (`int`) to subset by along the dimension."
+		*sel*: "Selector (`dict`). The selector is a dictionary where the key is a dimension name (`str`) and the value is a mask, a list of indexes (`list` or `np.array`), a slice (`slice`) or an index (`int`) to subset by along the dimension. Selection by a slice preserves the dimension and returns a view of the data where possible."
 		*range_*: "Range selector (`dict`). The range selector is a dictionary where the key is a dimension name (`str`) and the value is a pair (`list`, `tuple`, or `np.ndarray`) of indexes (`int`) for the start and the end of the range. If the index is `None`, the range is from the start or to the end of the dimension, respectively. Negative index values are counted from the end of the dimension. The range start is inclusive (closed), and the end is exclusive (open)."
 		*at*: "At selector (`dict`). The at selector is a dictionary where the key is a variable name (`str`) and the value is value or a list (`list`, `tuple`, or `np.ndarray`) of values. The dimension indexes corresponding the variable are constrained so that a variable value closest to the value is selected."
 		*between*: "Between selector (`dict`). The between selector is a dictionary where the key is a variable name (`str`) and the value a pair of values for the start and the end of a range. The dimension indexes corresponding to the variable are constrained so that variable values in the range are selected. If the value is `None`, the range start or end is unlimited. The range start is inclusive (closed), and the end is exclusive (open)."
@@ -1148,7 +1228,7 @@ $ ds.var(d, 'temperature')
 	}}
 	'''
 	check(d, 'd', dict)
-	check(sel, 'sel', [[dict, str]])
+	check(sel, 'sel', [[dict, str], None])
 	check(range_, 'range_', [[dict, str], None])
 	check(at, 'at', [[dict, str], None])
 	check(between, 'between', [[dict, str], None])
@@ -1178,8 +1258,10 @@ $ ds.size(d, 'temperature')
 	check(d, 'd', dict)
 	check(var, 'var', str)
 	if require(d, 'var', var, full=True):
-		if var in ds.vars(d):
-			data = ds.var(d, var)
+		if has_var(d, var):
+			data = d[ds.escape(var)]
+			if not isinstance(data, LazyArray):
+				data = ds.var(d, var)
 			return [] if data is None else list(data.shape)
 		else:
 			meta = ds.meta(d, var)
@@ -1264,6 +1346,7 @@ def time(d, var, *value):
 			meta['.time'] = True
 		elif '.time' in meta:
 			del meta['.time']
+		touch(d)
 
 def type_(d, var, *value):
 	'''
@@ -1295,6 +1378,8 @@ $ print(ds.var(d, 'temperature'))
 	if len(value) == 0:
 		if not require(d, 'var', var, full=True):
 			return None
+		if isinstance(d.get(ds.escape(var)), LazyArray):
+			return d[ds.escape(var)].type_
 		with ds.with_mode('soft'):
 			data = ds.var(d, var)
 		if data is None:
@@ -1308,6 +1393,7 @@ $ print(ds.var(d, 'temperature'))
 		   value[0] not in ALLOWED_TYPES:
 			raise ValueError('invalid type')
 		meta['.type'] = value[0]
+		touch(d)
 		data = ds.var(d, var)
 		if data is not None:
 			dt = misc.type_to_dtype(value[0])
@@ -1350,10 +1436,16 @@ array([17, 18, 22])"
 	if len(value) == 0:
 		if require(d, 'var', var):
 			data = d[var_e]
+			if isinstance(data, LazyArray):
+				d[var_e] = normalize_var(data.load())
+				if data.jd:
+					misc.process_cf_time_var(d, var)
+				return d[var_e]
 			return normalize_var(data)
 		return None
 	elif len(value) == 1:
-		d[var_e] = normalize_var(value[0])
+		d[var_e] = value[0] if isinstance(value[0], LazyArray) \
+			else normalize_var(value[0])
 	else:
 		raise TypeError('only one value argument is expected')
 
@@ -1382,6 +1474,8 @@ $ ds.vars(d, full=True)
 	}}
 	'''
 	check(d, 'd', dict)
+	if isinstance(d, Dataset) and not full:
+		return d.var_names()
 	meta = ds.meta(d)
 	vars_ = list(set(meta.keys()) | set(d.keys())) if full else d.keys()
 	return sorted([ds.unescape(x) for x in filter_hidden(vars_)])
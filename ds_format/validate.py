@@ -1,8 +1,11 @@
 from collections.abc import Mapping, Iterable
 import ds_format as ds
 from .op import gen_dims
+from .dataset import Dataset
 
 def validate(d):
+	if isinstance(d, Dataset) and d._valid:
+		return
 	if not isinstance(d, dict):
 		raise ValueError('dataset must be an instance of dict')
 	if '.' in d and not isinstance(d['.'], dict):
@@ -22,3 +25,5 @@ def validate(d):
 			dim_size[dim] = s
 		if not (dims is None or isinstance(dims, (list, tuple))):
 			raise ValueError('".dims" must be an instance of list or tuple or None')
+	if isinstance(d, Dataset):
+		d._valid = True